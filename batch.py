@@ -0,0 +1,153 @@
+# Bank Heist by Adam Sidat
+#
+# simulates lots of turret/trap layouts for a level at once, spread over all
+# of the computer's cores, and reports how well each layout did. this is used
+# to tune the difficulty of the levels
+#
+# a layout file is a JSON file that looks like this:
+#
+# {
+#     "level": 1,
+#     "layouts": [
+#         [[0, "uzi_turret", 0, 1], [300, "bomb_trap", 1, 5]],
+#         [[0, "pistol_turret", 2, 3], [600, "health_up", 0, 0]]
+#     ]
+# }
+#
+# every layout is a list of purchases, and every purchase is a list of the
+# tick to buy it at, the item (see ITEMS in engine.py) and the tile to place
+# it on. a purchase waits until there is enough cash for it. instead of a
+# layout file, random layouts can be generated with --random
+
+import sys
+import json
+import random
+import argparse
+import multiprocessing
+from engine import *
+
+# the columns of the results
+COLUMNS = ['layout', 'seed', 'won', 'ticks', 'gold', 'cash', 'kills', 'damage', 'purchases']
+
+# simulate one layout. (job) is a tuple of the layout's index, the level
+# number, the seed of the game and the layout itself. this runs in a worker process, so
+# it returns the results as a plain dictionary
+def evaluate(job):
+	index, level_num, seed, layout = job
+	purchases = sorted([(p[0], p[1], p[2], p[3]) for p in layout], key=lambda p: p[0])
+	game = simulate(level_num, purchases, seed)
+	return {
+		'layout': index,
+		'seed': seed,
+		'won': game.state == STATE_WON,
+		'ticks': game.ticks,
+		'gold': game.gold,
+		'cash': game.cash,
+		'kills': game.stat_kills,
+		'damage': game.stat_damage,
+		'purchases': game.purchases_made
+	}
+
+# check that a layout is a list of purchases that simulate() understands.
+# returns what is wrong with it, or None if nothing is
+def check_layout(layout):
+	if (not isinstance(layout, list)):
+		return 'it is not a list of purchases'
+	for k in range(0, len(layout)):
+		p = layout[k]
+		if (not isinstance(p, list) or len(p) != 4):
+			return 'purchase ' + str(k) + ' is not a list of a tick, an item and a tile'
+		if (not all(isinstance(x, int) and not isinstance(x, bool) for x in (p[0], p[2], p[3]))):
+			return 'purchase ' + str(k) + ' has a tick or tile that is not an integer'
+		if (p[1] != ITEM_HEALTH_UP and p[1] not in ITEMS):
+			return 'purchase ' + str(k) + ' has an unknown item ' + repr(p[1])
+	return None
+
+# generate a random layout for a level. it has (n) purchases, spread out
+# over the first (spread) ticks
+def random_layout(level, n, spread, rng):
+	walls = []
+	floors = []
+	for j in range(0, level.h):
+		for i in range(0, level.w):
+			tile = level.peek(i, j)
+			if (tile == TILE_WALL):
+				walls.append((i, j))
+			elif (tile == TILE_FLOOR):
+				floors.append((i, j))
+	out = []
+	for k in range(0, n):
+		item = rng.choice(sorted(ITEMS.keys()))
+		if (can_be_placed_on_wall(ITEMS[item])):
+			x, y = rng.choice(walls)
+		else:
+			x, y = rng.choice(floors)
+		out.append([rng.randint(0, spread), item, x, y])
+	return out
+
+# simulate all the layouts on a level in a pool of worker processes. returns
+# the results in the same order as the layouts
+def run_batch(level_num, layouts, processes=None, seed=0):
+	jobs = [(i, level_num, seed + i, layouts[i]) for i in range(0, len(layouts))]
+	with multiprocessing.Pool(processes) as pool:
+		return pool.map(evaluate, jobs, chunksize=max(1, len(jobs) // (4 * (processes or multiprocessing.cpu_count()))))
+
+# write the results as CSV
+def write_results(results, f):
+	f.write(','.join(COLUMNS) + '\n')
+	for r in results:
+		f.write(','.join(str(r[c]) for c in COLUMNS) + '\n')
+
+if (__name__ == '__main__'):
+	parser = argparse.ArgumentParser(description='simulate many turret/trap layouts for a Bank Heist level')
+	parser.add_argument('layouts', nargs='?', help='a JSON layout file')
+	parser.add_argument('--level', type=int, choices=[1, 2, 3], help='the level, if it is not in the layout file')
+	parser.add_argument('--random', type=int, default=0, metavar='N', help='simulate N random layouts instead of a layout file')
+	parser.add_argument('--purchases', type=int, default=6, help='the number of purchases in each random layout')
+	parser.add_argument('--spread', type=int, default=3000, help='random purchases happen within this many ticks')
+	parser.add_argument('--processes', type=int, default=None, help='the number of worker processes (default: one per core)')
+	parser.add_argument('--seed', type=parse_seed, default=0, help='the seed for the random layouts and the simulations')
+	parser.add_argument('--output', help='write the results to this CSV file instead of the standard output')
+	parser.add_argument('--top', type=int, default=10, help='print this many of the best layouts')
+	args = parser.parse_args()
+
+	# get the layouts
+	level_num = args.level
+	if (args.layouts is not None):
+		with open(args.layouts) as f:
+			data = json.load(f)
+		layouts = data['layouts']
+		if (level_num is None):
+			level_num = data.get('level', 1)
+	elif (args.random > 0):
+		if (level_num is None):
+			level_num = 1
+		rng = random.Random(args.seed)
+		level = load_level(level_num)
+		layouts = [random_layout(level, args.purchases, args.spread, rng) for i in range(0, args.random)]
+	else:
+		parser.error('either a layout file or --random is needed')
+	if (level_num not in (1, 2, 3)):
+		parser.error('there is no level ' + str(level_num))
+	# check the layouts before any of them are simulated, since a bad one
+	# would only fail in a worker process
+	for i in range(0, len(layouts)):
+		error = check_layout(layouts[i])
+		if (error is not None):
+			parser.error('layout ' + str(i) + ' is bad: ' + error)
+
+	results = run_batch(level_num, layouts, args.processes, args.seed)
+
+	# write all the results
+	if (args.output is not None):
+		with open(args.output, 'w') as f:
+			write_results(results, f)
+	else:
+		write_results(results, sys.stdout)
+
+	# summarize the best layouts, survivors first and then by remaining gold
+	best = sorted(results, key=lambda r: (not r['won'], -r['gold'], -r['kills']))[:args.top]
+	won = len([r for r in results if r['won']])
+	print('level', level_num, 'survived by', won, 'of', len(results), 'layouts', file=sys.stderr)
+	for r in best:
+		print('layout', r['layout'], 'won' if r['won'] else 'lost', 'gold', r['gold'], 'kills', r['kills'], 'cash', r['cash'], json.dumps(layouts[r['layout']]), file=sys.stderr)
@@ -0,0 +1,215 @@
+# Bank Heist by Adam Sidat
+#
+# a benchmark of the game simulation. every scenario sets up a reproducible
+# worst case on the engine (no display is needed), runs it for a number of
+# frames and reports how long each subsystem takes per frame and how much
+# memory it allocates per frame. the results can be saved and compared with
+# a later run, so that every optimization has a before and after number:
+#
+#     python bench.py --save before.json
+#     ...optimize something...
+#     python bench.py --compare before.json
+#
+# each scenario is run twice, once for the times and once with tracemalloc
+# for the allocations, because tracemalloc slows everything down
+
+import json
+import argparse
+import tracemalloc
+from engine import *
+from profiler import *
+
+# the seed that every scenario is played with
+BENCH_SEED = 1337
+
+# make an engine on a level for a scenario. the gold can't run out, so that
+# the scenario keeps going for as long as it is needed
+def bench_engine(level_num):
+	game = Engine(load_level(level_num), level_num, BENCH_SEED)
+	game.gold = 1000000000
+	return game
+
+# spawn (n) enemies from the spawner pattern, spread out evenly along the
+# path. (health) overrides their health, if given
+def spawn_along_path(game, n, health=None):
+	for i in range(0, n):
+		game.spawn_enemy(spawner[i % len(spawner)])
+		k = game.enemies.count - 1
+		game.enemies.position[k] = game.enemies.last_position[k] = i / float(n)
+		if (health is not None):
+			game.enemies.health[k] = game.enemies.max_health[k] = health
+
+# get the tiles of a level, sorted by how close they are to the path
+def tiles_near_path(level, tile):
+	out = []
+	for j in range(0, level.h):
+		for i in range(0, level.w):
+			if (level.peek(i, j) == tile):
+				d = min([abs(i - p[0]) + abs(j - p[1]) for p in level.pathway])
+				out.append((d, i, j))
+	out.sort()
+	return [(i, j) for d, i, j in out]
+
+# 200 enemies from the spawner pattern walking along level 3, with nothing
+# shooting them. this is mostly the enemies and the path code
+class EnemiesScenario:
+	name = 'enemies'
+	description = '200 enemies on level 3'
+
+	def setup(self):
+		self.game = bench_engine(3)
+		spawn_along_path(self.game, 200)
+
+	def frame(self):
+		self.game.step()
+		self.game.sounds.clear()
+
+# 100 uzi turrets around the path of level 3, shooting at enemies that can't
+# die. this is mostly the targeting code and the bullets
+class TurretsScenario:
+	name = 'turrets'
+	description = '100 uzi turrets on level 3'
+
+	def setup(self):
+		self.game = bench_engine(3)
+		walls = tiles_near_path(self.game.level, TILE_WALL)
+		for i in range(0, min(100, len(walls))):
+			self.game.currently_placing_turret = True
+			self.game.currently_placing_turret_type = TILE_UZI_TURRET
+			self.game.place(walls[i][0], walls[i][1])
+		spawn_along_path(self.game, 100, 1000000000.0)
+		self.game.particles.clear()
+
+	def frame(self):
+		self.game.step()
+		self.game.sounds.clear()
+
+# every floor tile of level 3 is a bomb trap, and enemies keep walking into
+# them, so there are explosions (500 particles each) going off one after
+# another. the bombs are put back every second. this is mostly the particles
+# and the blood
+class BombsScenario:
+	name = 'bombs'
+	description = 'a chain of bomb traps on level 3'
+
+	def setup(self):
+		self.game = bench_engine(3)
+		self.floors = tiles_near_path(self.game.level, TILE_FLOOR)
+		self.frames = 0
+		self.arm()
+		spawn_along_path(self.game, 40)
+
+	# put a bomb trap on every floor tile that doesn't have one. the traps are
+	# put straight down instead of being placed like the player does, since
+	# placing one makes a particle burst, and those would drown out the
+	# explosions
+	def arm(self):
+		for i in range(0, len(self.floors)):
+			x, y = self.floors[i]
+			if (self.game.level.peek(x, y) == TILE_FLOOR):
+				self.game.add_trap(TRAP_BOMB, x, y)
+				self.game.level.poke(x, y, TILE_BOMB_TRAP)
+
+	def frame(self):
+		if (self.frames % TICK_RATE == 0):
+			self.arm()
+			self.game.profiler.lap('bench.arm')
+		self.game.step()
+		self.game.sounds.clear()
+		self.frames += 1
+
+# the title screen, with its ambient explosions going off at random. this is
+# only the particles, since the title screen doesn't step the game
+class TitleScenario:
+	name = 'title'
+	description = 'the title screen\'s ambient explosions'
+
+	def setup(self):
+		self.game = bench_engine(3)
+
+	def frame(self):
+		game = self.game
+		lap = game.profiler.lap
+		# just like the title screen, but the explosions go off a bit more
+		# often so that there are enough of them in a short benchmark
+		if (game.effects.randint(0, 5) == 0):
+			a = 64
+			game.add_explosion(game.effects.randint(-a, window_w + a - 1), game.effects.randint(-a, window_h + a - 1))
+		lap('title.explosions')
+		game.particles.tick(game.level)
+		lap('title.tick')
+		game.particles.bleed(game.level)
+		lap('title.bleed')
+		game.particles.compact()
+		lap('title.compact')
+
+# all the scenarios
+SCENARIOS = [EnemiesScenario, TurretsScenario, BombsScenario, TitleScenario]
+
+# run a scenario for (frames) frames and return the profiler's statistics.
+# the scenario is set up from scratch, so every run is the same
+def run_scenario(scenario, frames, track_memory):
+	scenario.setup()
+	profiler = Profiler(window=frames, track_memory=track_memory)
+	scenario.game.profiler = profiler
+	if (track_memory):
+		tracemalloc.start()
+	for i in range(0, frames):
+		profiler.begin_frame()
+		scenario.frame()
+		profiler.end_frame()
+	if (track_memory):
+		tracemalloc.stop()
+	return profiler.stats()
+
+# run a scenario for the times and then for the allocations, and put the two
+# together
+def bench_scenario(scenario, frames):
+	stats = run_scenario(scenario, frames, False)
+	memory = run_scenario(scenario, frames, True)
+	for name in stats:
+		stats[name]['alloc_kb'] = memory[name]['alloc_kb'] if name in memory else 0.0
+	return stats
+
+# print the results of a scenario. if there is a baseline for the scenario,
+# the change in the mean time of every subsystem is printed too
+def print_scenario(scenario, stats, baseline=None):
+	print(scenario.name + ': ' + scenario.description)
+	header = '  %-18s %8s %8s %8s %10s' % ('subsystem', 'mean ms', 'p95 ms', 'p99 ms', 'alloc kb')
+	if (baseline is not None):
+		header += ' %8s' % 'change'
+	print(header)
+	names = sorted([name for name in stats if name != 'frame'], key=lambda name: -stats[name]['mean'])
+	for name in ['frame'] + names:
+		s = stats[name]
+		line = '  %-18s %8.3f %8.3f %8.3f %10.1f' % (name, s['mean'], s['p95'], s['p99'], s['alloc_kb'])
+		if (baseline is not None and name in baseline and baseline[name]['mean'] > 0.0):
+			line += ' %+7.1f%%' % ((s['mean'] / baseline[name]['mean'] - 1.0) * 100.0)
+		print(line)
+	print()
+
+if (__name__ == '__main__'):
+	parser = argparse.ArgumentParser(description='benchmark the Bank Heist simulation with some worst case scenarios')
+	parser.add_argument('scenarios', nargs='*', help='the scenarios to run (default: all of them): ' + ', '.join(s.name for s in SCENARIOS))
+	parser.add_argument('--frames', type=int, default=300, help='the number of frames to run each scenario for')
+	parser.add_argument('--save', metavar='PATH', help='save the results to this JSON file')
+	parser.add_argument('--compare', metavar='PATH', help='compare the results with ones saved by --save')
+	args = parser.parse_args()
+
+	scenarios = [s() for s in SCENARIOS if len(args.scenarios) == 0 or s.name in args.scenarios]
+	if (len(scenarios) == 0):
+		parser.error('no such scenario')
+
+	baseline = {}
+	if (args.compare is not None):
+		with open(args.compare) as f:
+			baseline = json.load(f)['scenarios']
+
+	results = {}
+	for scenario in scenarios:
+		results[scenario.name] = bench_scenario(scenario, args.frames)
+		print_scenario(scenario, results[scenario.name], baseline.get(scenario.name))
+
+	if (args.save is not None):
+		with open(args.save, 'w') as f:
+			json.dump({'frames': args.frames, 'seed': BENCH_SEED, 'scenarios': results}, f, indent=4)
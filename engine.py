@@ -0,0 +1,1595 @@
+# Bank Heist by Adam Sidat
+#
+# this is the simulation core of the game. it knows about levels, enemies,
+# turrets, traps, bullets, particles and money, but nothing about pygame. the
+# game (main.py) draws whatever is in here, but the engine can just as well be
+# stepped on its own, for example on a server without a display
+
+import os
+import math
+import collections
+import pickle
+import struct
+import argparse
+import random
+import hashlib
+import numpy as np
+from profiler import Profiler, FRAME_BUDGET
+
+# the following are math functions. these are used all over the program so it
+# makes sense to define them first
+
+# checks if a point is within an axis-aligned bounding box (AABB)
+def in_aabb_raw(x, y, aabbx, aabby, aabbw, aabbh):
+	# do 1-dimensional overlap checks
+	x1d = x >= aabbx and x <= aabbx + aabbw
+	y1d = y >= aabby and y <= aabby + aabbh
+	return x1d and y1d
+
+# checks if a point is within an axis-aligned bounding box (AABB), but uses an
+# object-oriented approach instead
+def in_aabb(point, aabb):
+	# do 1-dimensional overlap checks
+	x1d = point[0] >= aabb[0] and point[0] <= aabb[0] + aabb[2]
+	y1d = point[1] >= aabb[1] and point[1] <= aabb[1] + aabb[3]
+	return x1d and y1d
+
+# clamp a value so it is not less than min or greater than max
+def clamp(x, _min, _max):
+	if (x < _min):
+		x = _min
+	elif (x > _max):
+		x = _max
+	return x
+
+# find the squared distance between two points
+def dist2(a, b):
+	dx = b[0] - a[0]
+	dy = b[1] - a[1]
+	return dx * dx + dy * dy
+
+# find the distance between two points
+def dist(a, b):
+	dx = b[0] - a[0]
+	dy = b[1] - a[1]
+	return math.sqrt(dx * dx + dy * dy)
+
+# find the normal/unit vector to get from one point to another. this is
+# defined for a normal/unit vector (u) such that a+u*dist(a,b)=b
+def unit(a, b):
+	dx = b[0] - a[0]
+	dy = b[1] - a[1]
+	l = math.sqrt(dx * dx + dy * dy)
+	return (dx / l, dy / l)
+
+# find the angle from one point to another
+def angle_to(a, b):
+	u = unit(a, b)
+	return math.atan2(u[0], u[1])
+
+# get a signed random number. (rng) is the random number generator to use, so
+# that the game can draw from its own seeded stream
+def signed_rand(rng=random):
+	return rng.random() * 2.0 - 1.0
+
+# a uniform grid over a list of points. each point is put into the cell that
+# it lies in, so finding the nearest point within some range only has to look
+# at the few cells that overlap that range instead of at every single point
+class SpatialGrid:
+	# create a grid over the points (a) with cells that are (cell) wide
+	def __init__(self, a, cell):
+		self.points = a
+		self.cell = cell
+		self.cells = {}
+		for i in range(0, len(a)):
+			key = (int(a[i][0] // cell), int(a[i][1] // cell))
+			bucket = self.cells.get(key)
+			if (bucket is None):
+				self.cells[key] = [i]
+			else:
+				bucket.append(i)
+
+	# find the index of the nearest point to the point (p) that is less than
+	# (r) away from it. returns -1 if there is no such point. ties are broken
+	# by index, so the earliest point wins, the same as a linear scan would
+	def nearest_within(self, p, r):
+		lowest_distance = r * r
+		lowest_index = -1
+		cell = self.cell
+		x0 = int((p[0] - r) // cell)
+		x1 = int((p[0] + r) // cell)
+		y0 = int((p[1] - r) // cell)
+		y1 = int((p[1] + r) // cell)
+		for cx in range(x0, x1 + 1):
+			for cy in range(y0, y1 + 1):
+				bucket = self.cells.get((cx, cy))
+				if (bucket is None):
+					continue
+				for i in bucket:
+					d = dist2(p, self.points[i])
+					if (d < lowest_distance or (d == lowest_distance and lowest_index != -1 and i < lowest_index)):
+						lowest_distance = d
+						lowest_index = i
+		return lowest_index
+
+# tile sizing constants
+tile_w = 16
+tile_h = 16
+
+# level sizing constants. levels can be any size, and this is the size of
+# the part of a level that is shown at once (the view). a level that is
+# bigger than that is scrolled around with a camera
+level_w = 20
+level_h = 15
+
+# levels are split into square chunks of this many tiles for drawing and for
+# the blood effects, so that only the chunks that are in view have to be
+# drawn, and only the chunks that got bloody take up memory
+LEVEL_CHUNK = 16
+
+# the enemies walk the longest route of a level in the same number of steps,
+# however long it is, up to this many steps (the longest route of the levels
+# that come with the game). on longer routes they walk at the pace they would
+# on a route this long, so that they don't skip over tiles (and the traps on
+# them) on big levels
+LEVEL_PACE_STEPS = 130
+
+# window sizing constants. the simulation happens in window pixels, so these
+# are needed even when there is no window
+window_border_x = 4
+window_border_y = 4
+window_tile_w = 25
+window_tile_h = 20
+window_w = window_border_x * 2 + window_tile_w * tile_w
+window_h = window_border_y * 2 + window_tile_h * tile_h
+
+# calculate the offset at which to draw any level (the top left corner of the
+# view). the simulation happens in these pixels too, so a tile (i, j) of any
+# level is at (level_offset_x + i * tile_w, level_offset_y + j * tile_h)
+level_offset_x = window_w / 2 - (level_w * tile_w) / 2
+level_offset_y = window_h / 2 - ((level_h - 3) * tile_h) / 2
+
+# generate enumeration values for each tile
+TILE_WALL = 0
+TILE_FLOOR = 1
+TILE_PISTOL_TURRET = 2
+TILE_SHOTGUN_TURRET = 3
+TILE_UZI_TURRET = 4
+TILE_GOLD = 5
+TILE_SPIKE_TRAP = 6
+TILE_BOMB_TRAP = 7
+TILE_SPAWN = 8
+TILE_NOPE = 9
+
+# returns True if a turret/trap can be placed on a wall
+def can_be_placed_on_wall(t):
+	return t == TILE_PISTOL_TURRET or \
+	       t == TILE_SHOTGUN_TURRET or \
+	       t == TILE_UZI_TURRET or \
+	       t == TILE_WALL
+
+# returns True if a turret/trap can be placed on the floor
+def can_be_placed_on_floor(t):
+	return t == TILE_SPIKE_TRAP or \
+	       t == TILE_BOMB_TRAP or \
+	       t == TILE_FLOOR
+
+# load a file as a list of strings (one for each line)
+def load_file(path):
+	return open(path).readlines()
+
+# the directory that things which take a while to work out are cached in. it
+# can be deleted at any time, everything in it is worked out again if needed
+CACHE_DIR = 'cache'
+
+# get a hash of the contents of a file, as a string
+def hash_file(path):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+# load something from the cache. returns None if it isn't there, or if it
+# can't be read for whatever reason
+def load_cached(name):
+	try:
+		with open(os.path.join(CACHE_DIR, name), 'rb') as f:
+			return pickle.load(f)
+	except Exception:
+		return None
+
+# save something to the cache. it doesn't matter if that fails, since the
+# cache is only there to make things faster
+def save_cached(name, value):
+	try:
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		with open(os.path.join(CACHE_DIR, name), 'wb') as f:
+			pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+	except OSError:
+		pass
+
+# the tile that each character of a level file stands for. anything else is
+# floor
+LEVEL_CHARACTERS = {'#': TILE_WALL, 'G': TILE_GOLD, 'S': TILE_SPAWN}
+
+# compiled levels. a level file is compiled into a small binary file the
+# first time it is loaded, with everything that takes a while to work out
+# from the text (the tiles, the floor mask and the routes), and the compiled
+# level is loaded instead of the text after that. a compiled level starts
+# with a header:
+#
+#     magic, version, the level file's mtime (in nanoseconds), size and
+#     sha1, the width and height of the level and the number of routes
+#
+# followed by the length and gold_progress of every route, the tiles (w * h
+# bytes), the floor mask (w * h bytes) and the points of every route (two
+# 16-bit integers each). if the level file's mtime or size changed, it is
+# hashed, and it is only compiled again if the hash changed too
+LEVEL_MAGIC = b'BHLV'
+LEVEL_VERSION = 5
+LEVEL_HEADER = '<4sBqI20sHHI'
+LEVEL_ROUTE = '<Id'
+
+# get the path that a level file's compiled level is cached at
+def compiled_level_path(path):
+	return os.path.join(CACHE_DIR, os.path.splitext(os.path.basename(path))[0] + '.bin')
+
+# a level
+class Level:
+	# load a level from a file
+	def __init__(self, path):
+		# the floor mask is calculated lazily, see floor_mask()
+		self.floor = None
+
+		# load the compiled level if there is one that is up to date, or
+		# compile the level file otherwise
+		if (not self.load_compiled(path)):
+			self.compile(path)
+
+		# the blood effects of each chunk (see blood_chunk()), made when the
+		# chunk first gets bloody. each one is indexed by [y, x] and has an
+		# RGBA color for each pixel of the chunk, so that it can be shown
+		# without copying it (see pygame.image.frombuffer)
+		self.blood = {}
+
+		# the tiles that changed since the level was last drawn (the dirty
+		# tiles), and pre-rendered copies of the chunks of the level that
+		# belong to whoever draws it. only the dirty tiles have to be drawn
+		# again
+		self.backgrounds = {}
+		self.dirty = set()
+		# the surfaces that whoever draws the level shows the blood effects
+		# of each chunk with
+		self.blood_surfaces = {}
+
+	# parse a level file, calculate its path and save the compiled level
+	def compile(self, path):
+		lines = [line.rstrip('\n') for line in load_file(path)]
+		while (len(lines) > 0 and len(lines[-1]) == 0):
+			lines.pop()
+		# the level is as wide as its longest line, and short lines are
+		# padded with walls
+		self.w = max([len(line) for line in lines])
+		self.h = len(lines)
+		self.original_data = bytearray(self.w * self.h)
+		for j in range(0, self.h):
+			line = lines[j]
+			for i in range(0, self.w):
+				self.original_data[j * self.w + i] = LEVEL_CHARACTERS.get(line[i], TILE_FLOOR) if i < len(line) else TILE_WALL
+		self.data = bytearray(self.original_data)
+
+		# calculate the path to traverse the level
+		self.calculate_path()
+
+		self.original_floor = self.floor_mask()
+		stat = os.stat(path)
+		self.save_compiled(path, stat.st_mtime_ns, stat.st_size, bytes.fromhex(hash_file(path)))
+
+	# save the compiled level. (mtime), (size) and (digest) are those of the
+	# level file it was compiled from
+	def save_compiled(self, path, mtime, size, digest):
+		parts = [struct.pack(LEVEL_HEADER, LEVEL_MAGIC, LEVEL_VERSION, mtime, size, digest, self.w, self.h, len(self.routes))]
+		for r in range(0, len(self.routes)):
+			parts.append(struct.pack(LEVEL_ROUTE, len(self.routes[r]), self.gold_progress[r]))
+		parts.append(bytes(self.original_data))
+		parts.append(self.original_floor.astype(np.uint8).tobytes())
+		parts.append(np.array([p for route in self.routes for p in route], dtype='<u2').tobytes())
+		# the compiled level is written to a temporary file first and then
+		# moved into place, so that another process loading the level at the
+		# same time (see batch.py) never reads a half-written one
+		compiled_path = compiled_level_path(path)
+		temp_path = compiled_path + '.' + str(os.getpid()) + '.tmp'
+		try:
+			os.makedirs(CACHE_DIR, exist_ok=True)
+			with open(temp_path, 'wb') as f:
+				f.write(b''.join(parts))
+			os.replace(temp_path, compiled_path)
+		except OSError:
+			pass
+
+	# load the compiled level of a level file. returns False if there isn't
+	# one, or if it is out of date
+	def load_compiled(self, path):
+		try:
+			with open(compiled_level_path(path), 'rb') as f:
+				compiled = f.read()
+			stat = os.stat(path)
+		except OSError:
+			return False
+		offset = struct.calcsize(LEVEL_HEADER)
+		if (len(compiled) < offset):
+			return False
+		magic, version, mtime, file_size, digest, w, h, m = struct.unpack_from(LEVEL_HEADER, compiled)
+		if (magic != LEVEL_MAGIC or version != LEVEL_VERSION):
+			return False
+		if (len(compiled) < offset + m * struct.calcsize(LEVEL_ROUTE)):
+			return False
+		lengths = []
+		gold_progress = []
+		for r in range(0, m):
+			n, g = struct.unpack_from(LEVEL_ROUTE, compiled, offset)
+			lengths.append(n)
+			gold_progress.append(g)
+			offset += struct.calcsize(LEVEL_ROUTE)
+		if (m == 0 or len(compiled) != offset + w * h * 2 + sum(lengths) * 4):
+			return False
+		# the level file was touched, so check whether it really changed
+		touched = mtime != stat.st_mtime_ns or file_size != stat.st_size
+		if (touched and bytes.fromhex(hash_file(path)) != digest):
+			return False
+
+		self.w = w
+		self.h = h
+		self.original_data = bytearray(compiled[offset:offset + w * h])
+		self.data = bytearray(self.original_data)
+		offset += w * h
+		self.original_floor = np.frombuffer(compiled, dtype=np.uint8, count=w * h, offset=offset).reshape(h, w).astype(bool)
+		self.floor = self.original_floor
+		offset += w * h
+		points = np.frombuffer(compiled, dtype='<u2', offset=offset).reshape(-1, 2).tolist()
+		routes = []
+		k = 0
+		for n in lengths:
+			routes.append([tuple(p) for p in points[k:k + n]])
+			k += n
+		self.use_routes(routes)
+		self.gold_progress = np.array(gold_progress)
+
+		# don't hash the level file every time from now on
+		if (touched):
+			self.save_compiled(path, stat.st_mtime_ns, stat.st_size, digest)
+		return True
+
+	# don't ask
+	def clear_up_the_bloody_floor_please_and_thank_you(self):
+		# fill the blood effect arrays with a transparent color. they are kept,
+		# since whoever draws them may be sharing their pixels
+		for chunk in self.blood.values():
+			chunk.fill(0)
+
+	# reset the level
+	def reset(self):
+		self.clear_up_the_bloody_floor_please_and_thank_you()
+		self.data[:] = self.original_data
+		self.floor = self.original_floor
+		self.invalidate()
+
+	# forget the pre-rendered chunks, so that the whole level is drawn again
+	def invalidate(self):
+		self.backgrounds.clear()
+		self.dirty.clear()
+		self.blood_surfaces.clear()
+
+	# calculate the routes that the enemies take through this level. first a
+	# flow field is worked out: a breadth-first search from the gold gives
+	# every tile the number of steps to the nearest gold tile (or -1 if the
+	# gold can't be reached from it). then every spawn tile gets a route that
+	# just follows the flow field downhill, so there can be any number of
+	# spawns, and forks and loops are fine: the enemies take the shortest way
+	def calculate_path(self):
+		# find the spawn and gold tiles
+		spawns = []
+		flow = [-1] * (self.w * self.h)
+		queue = collections.deque()
+		for j in range(0, self.h):
+			for i in range(0, self.w):
+				tile = self.peek(i, j)
+				if (tile == TILE_SPAWN):
+					spawns.append((i, j))
+				elif (tile == TILE_GOLD):
+					flow[j * self.w + i] = 0
+					queue.append((i, j))
+
+		# work out the flow field. the enemies walk on floor and spawn tiles
+		while (len(queue) > 0):
+			i, j = queue.popleft()
+			d = flow[j * self.w + i] + 1
+			for x, y in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+				tile = self.peek(x, y)
+				if ((tile == TILE_FLOOR or tile == TILE_SPAWN) and flow[y * self.w + x] == -1):
+					flow[y * self.w + x] = d
+					queue.append((x, y))
+
+		# follow the flow field from every spawn
+		routes = []
+		for x, y in spawns:
+			if (flow[y * self.w + x] == -1):
+				print('bad level')
+				exit()
+			tiles = [(x, y)]
+			while (flow[y * self.w + x] > 0):
+				d = flow[y * self.w + x] - 1
+				for i, j in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+					if (i >= 0 and i < self.w and j >= 0 and j < self.h and flow[j * self.w + i] == d):
+						break
+				x = i
+				y = j
+				tiles.append((x, y))
+			# the tile right before the gold isn't on the route, so enemies cut
+			# the corner into the gold. that's how the game always walked, and
+			# it keeps the timing of the enemies (and old replays) the same
+			routes.append(tiles[:-2] + tiles[-1:])
+		if (len(routes) == 0):
+			print('bad level')
+			exit()
+		self.use_routes(routes)
+
+		# find how far along each route an enemy has to be to sit on the gold,
+		# so that enemies don't have to be tested against the gold tile one at
+		# a time. an enemy sits on the gold when its position is within the
+		# gold tile's bounding box, edges included. the last few points of the
+		# route are in there, and an enemy walks into it on the segment before
+		# them
+		self.gold_progress = np.zeros(len(routes))
+		for r in range(0, len(routes)):
+			pathway = routes[r]
+			gold = pathway[-1]
+			n = len(pathway)
+			k = n - 1
+			while (k > 0 and self.on_gold(pathway[k - 1], gold)):
+				k -= 1
+			if (k == 0):
+				continue
+			# find the first position on that segment that is on the gold,
+			# using the very same math that positions() does
+			lo = (k - 1) / (n - 1.0)
+			hi = k / (n - 1.0)
+			for z in range(0, 64):
+				mid = (lo + hi) / 2.0
+				if (mid <= lo or mid >= hi):
+					break
+				x, y = self.positions(np.array([mid]), r)
+				if (self.on_gold((x[0], y[0]), gold)):
+					hi = mid
+				else:
+					lo = mid
+			self.gold_progress[r] = hi
+
+	# store the routes. the first one is also kept as the pathway, and its
+	# gold tile as the gold tile. all of the routes are stored one after
+	# another in arrays too, along with the offset from each point to the next
+	# one, so that positions can be looked up for a lot of scalars at once (see
+	# positions()). every step of a route goes to a neighbouring tile, so
+	# almost every segment is one tile long and the scalar is close to
+	# proportional to the arc length
+	#
+	# the enemies walk the longest route at their own speed (or at the pace
+	# of a route LEVEL_PACE_STEPS long if it is longer than that), and every
+	# other route at the same pace in tiles, so their speed on each route is
+	# scaled by (route_scale[route]). a short route is walked in fewer steps
+	# than a long one
+	def use_routes(self, routes):
+		self.routes = routes
+		self.pathway = routes[0]
+		self.gold_x, self.gold_y = routes[0][-1]
+		self.route_length = np.array([len(route) for route in routes], dtype=np.int32)
+		self.route_start = np.append(0, np.cumsum(self.route_length)[:-1]).astype(np.int32)
+		steps = np.maximum(self.route_length - 1, 1)
+		self.route_scale = min(steps.max(), LEVEL_PACE_STEPS) / steps
+		self.path_x = np.array([p[0] for route in routes for p in route], dtype=float)
+		self.path_y = np.array([p[1] for route in routes for p in route], dtype=float)
+		self.path_dx = np.append(np.diff(self.path_x), 0.0)
+		self.path_dy = np.append(np.diff(self.path_y), 0.0)
+		# the last point of a route doesn't go anywhere
+		last = self.route_start + self.route_length - 1
+		self.path_dx[last] = 0.0
+		self.path_dy[last] = 0.0
+
+	# returns True if a position (in tiles) is within the bounding box of the
+	# gold tile (gold), edges included. this is done in pixels, just like the
+	# game used to
+	def on_gold(self, p, gold):
+		px = level_offset_x + p[0] * tile_w
+		py = level_offset_y + p[1] * tile_h
+		aabbx = gold[0] * tile_w + level_offset_x
+		aabby = gold[1] * tile_h + level_offset_y
+		return in_aabb_raw(px, py, aabbx, aabby, tile_w, tile_h)
+
+	# get the positions along routes for an array of scalars at once. (route)
+	# is the route of every scalar, or one route for all of them. a scalar of
+	# 0 is the start of its route and 1 is the end. in between, positions are
+	# interpolated. returns an array of x coordinates and an array of y
+	# coordinates
+	def positions(self, x, route=0):
+		n = self.route_length[route]
+		f = np.clip(np.asarray(x, dtype=float) * (n - 1), 0, n - 1)
+		# f is never negative, so astype() is the same as math.floor()
+		i = f.astype(np.int32)
+		t = f - i
+		i += self.route_start[route]
+		return (self.path_x[i] + self.path_dx[i] * t, self.path_y[i] + self.path_dy[i] * t)
+
+	# fetch a tile
+	def peek(self, i, j):
+		if (i < 0 or i >= self.w or j < 0 or j >= self.h):
+			return TILE_WALL
+		# this array is 'flattened', this is the C-way of doing 2-dimensional
+		# arrays
+		return self.data[j * self.w + i]
+
+	# set a tile
+	def poke(self, i, j, tile):
+		if (not (i < 0 or i >= self.w or j < 0 or j >= self.h)):
+			self.data[j * self.w + i] = tile
+			self.dirty.add((i, j))
+			# update the floor mask in place instead of working it out again
+			# for the whole level. the original floor mask is shared, so it is
+			# copied first
+			if (self.floor is not None):
+				if (self.floor is self.original_floor):
+					self.floor = self.floor.copy()
+				self.floor[j, i] = tile == TILE_FLOOR or tile == TILE_SPIKE_TRAP or tile == TILE_BOMB_TRAP
+
+	# get a 2-dimensional boolean array (indexed by [j, i]) that is True for
+	# every tile that counts as floor
+	def floor_mask(self):
+		if (self.floor is None):
+			data = np.frombuffer(self.data, dtype=np.uint8).reshape(self.h, self.w)
+			self.floor = (data == TILE_FLOOR) | (data == TILE_SPIKE_TRAP) | (data == TILE_BOMB_TRAP)
+		return self.floor
+
+	# get the blood effects of the chunk (ci, cj), making them if the chunk
+	# isn't bloody yet. the chunk's top left pixel is at (level_offset_x + ci *
+	# LEVEL_CHUNK * tile_w, level_offset_y + cj * LEVEL_CHUNK * tile_h)
+	def blood_chunk(self, ci, cj):
+		chunk = self.blood.get((ci, cj))
+		if (chunk is None):
+			chunk = np.zeros((LEVEL_CHUNK * tile_h, LEVEL_CHUNK * tile_w, 4), dtype=np.uint8)
+			self.blood[(ci, cj)] = chunk
+		return chunk
+
+	# add blood to a batch of pixels at once. x and y are arrays of pixel
+	# positions and color is an array with one color for each pixel. all of
+	# the blood is accumulated first and then added to the blood arrays of the
+	# chunks in one go, saturating at 255
+	def add_blood(self, x, y, color):
+		# get the pixel positions relative to the level
+		px = x.astype(np.int32) - int(level_offset_x)
+		py = y.astype(np.int32) - int(level_offset_y)
+		# make sure it's in bounds
+		keep = (px >= 0) & (px < self.w * tile_w) & (py >= 0) & (py < self.h * tile_h)
+		px = px[keep]
+		py = py[keep]
+		color = color[keep]
+		# only set the pixels that are on a floor tile
+		tx = px // tile_w
+		ty = py // tile_h
+		keep = self.floor_mask()[ty, tx]
+		if (not keep.any()):
+			return
+		px = px[keep]
+		py = py[keep]
+		ci = tx[keep] // LEVEL_CHUNK
+		cj = ty[keep] // LEVEL_CHUNK
+		color = color[keep]
+		# number every pixel by its chunk first and then by its position in the
+		# chunk, so that the pixels of each chunk end up next to each other
+		cw = LEVEL_CHUNK * tile_w
+		ch = LEVEL_CHUNK * tile_h
+		chunks_w = (self.w + LEVEL_CHUNK - 1) // LEVEL_CHUNK
+		pixel = ((cj * chunks_w + ci) * ch + py - cj * ch) * cw + px - ci * cw
+		# accumulate the blood of every particle on the same pixel
+		index, inverse = np.unique(pixel, return_inverse=True)
+		s = 16
+		amount = np.empty((len(index), 4), dtype=np.int32)
+		for c in range(0, 3):
+			amount[:, c] = np.bincount(inverse, weights=color[:, c] // s, minlength=len(index))
+		amount[:, 3] = np.bincount(inverse, minlength=len(index)) * 8
+		# add it to the blood arrays of the chunks, one run of pixels per chunk
+		chunk = index // (cw * ch)
+		index = index - chunk * (cw * ch)
+		bounds = [0] + (np.flatnonzero(np.diff(chunk)) + 1).tolist() + [len(chunk)]
+		for k in range(0, len(bounds) - 1):
+			start = bounds[k]
+			end = bounds[k + 1]
+			key = int(chunk[start])
+			blood = self.blood_chunk(key % chunks_w, key // chunks_w).reshape(-1, 4)
+			i = index[start:end]
+			blood[i] = np.minimum(blood[i] + amount[start:end], 255)
+
+# all enemy types
+ENEMY_GRUNT = 0
+ENEMY_SPEEDY = 1
+ENEMY_BULK = 2
+
+# enemy speed multipliers. index by enemy type. an enemy walks E_BASE_SPEED of
+# the longest route of its level each step (see LEVEL_PACE_STEPS)
+E_BASE_SPEED = 0.001
+E_SPEED = [1.0, 1.75, 0.6]
+# enemy damage multipliers. index by enemy type
+E_BASE_DAMAGE = 7.5
+E_DAMAGE = [1.0, 0.75, 3.0]
+# enemy health multipliers. index by enemy type
+E_BASE_HEALTH = 5.0
+E_HEALTH = [1.5, 1.25, 5.5]
+
+# enemy loot drops
+E_LOOT = [15, 20, 25]
+
+# enemy colors. index by enemy type
+E_COLOR = [(255, 153, 35), (119, 179, 0), (0, 74, 179)]
+
+# how many steps there are between the times an enemy damages the gold
+E_GOLD_DAMAGE_PERIOD = 60
+
+# all the enemies. instead of having one object per enemy, every property of
+# every enemy is stored in its own contiguous array, like the particles are.
+# this way all of the enemies can be moved, checked for touching the gold and
+# swept away when they die at once using numpy
+class EnemyPool:
+	# create an empty pool of enemies
+	def __init__(self, capacity=256):
+		self.count = 0
+		self.variation = np.zeros(0, dtype=np.int32)
+		# the route that each enemy walks along (see Level.routes)
+		self.route = np.zeros(0, dtype=np.int32)
+		self.position = np.zeros(0)
+		# the position before the last tick, for drawing in between ticks
+		self.last_position = np.zeros(0)
+		self.speed = np.zeros(0)
+		self.health = np.zeros(0)
+		self.max_health = np.zeros(0)
+		# staggers when each enemy damages the gold
+		self.id = np.zeros(0, dtype=np.int64)
+		self.reserve(capacity)
+
+	# the number of enemies
+	def __len__(self):
+		return self.count
+
+	# make sure the arrays can hold at least (capacity) enemies. the arrays
+	# grow geometrically, so spawning enemies is cheap on average
+	def reserve(self, capacity):
+		old_capacity = len(self.id)
+		if (capacity <= old_capacity):
+			return
+		capacity = max(capacity, old_capacity * 2)
+		n = self.count
+		for name in ('variation', 'route', 'position', 'last_position', 'speed', 'health', 'max_health', 'id'):
+			old = getattr(self, name)
+			new = np.zeros(capacity, dtype=old.dtype)
+			new[:n] = old[:n]
+			setattr(self, name, new)
+
+	# remove all the enemies
+	def clear(self):
+		self.count = 0
+
+	# spawn an enemy at the start of the route (route). (id) staggers when the
+	# enemy damages the gold, so it comes from the game's random number
+	# generator. the enemy's speed is scaled by (scale), see Level.route_scale
+	def spawn(self, variation, id, route=0, scale=1.0):
+		self.reserve(self.count + 1)
+		i = self.count
+		self.variation[i] = variation
+		self.route[i] = route
+		self.position[i] = 0.0
+		self.last_position[i] = 0.0
+		self.speed[i] = E_BASE_SPEED * E_SPEED[variation] * scale
+		self.health[i] = E_BASE_HEALTH * E_HEALTH[variation]
+		self.max_health[i] = E_BASE_HEALTH * E_HEALTH[variation]
+		self.id[i] = id
+		self.count = i + 1
+
+	# move all the enemies along the path at once
+	def tick(self):
+		n = self.count
+		self.last_position[:n] = self.position[:n]
+		self.position[:n] += self.speed[:n]
+
+	# get the indices of the enemies that damage the gold on the step (ticks).
+	# every enemy does that periodically while it is sitting on the gold,
+	# which is everywhere past (gold_progress[route]) along its route (see
+	# Level.gold_progress)
+	def gold_contacts(self, ticks, gold_progress):
+		n = self.count
+		due = (ticks + self.id[:n]) % E_GOLD_DAMAGE_PERIOD == 0
+		return np.flatnonzero(due & (self.position[:n] >= gold_progress[self.route[:n]]))
+
+	# get the indices of the dead enemies
+	def dead(self):
+		return np.flatnonzero(self.health[:self.count] <= 0)
+
+	# remove all the dead enemies in bulk
+	def compact(self):
+		n = self.count
+		alive = self.health[:n] > 0
+		m = int(np.count_nonzero(alive))
+		if (m == n):
+			return
+		for name in ('variation', 'route', 'position', 'last_position', 'speed', 'health', 'max_health', 'id'):
+			array = getattr(self, name)
+			array[:m] = array[:n][alive]
+		self.count = m
+
+# all turret types
+TURRET_PISTOL = 0
+TURRET_SHOTGUN = 1
+TURRET_UZI = 2
+
+# turret cooldowns
+TURRET_COOLDOWN = [35, 85, 10]
+# turret accuracy (low is better)
+TURRET_ACCURACY = [0.0, 19.0, 4.0]
+# turret bullets per shot
+TURRET_BULLETS = [1, 10, 1]
+# turret damage modifiers
+TURRET_DAMAGE = [0.5, 0.35, 0.1]
+# turret ranges
+TURRET_RANGE = [80.0, 50.0, 100.0]
+
+# turret base damage
+TURRET_BASE_DAMAGE = 2.5
+
+# the size of each cell of the grid used to find targets for turrets. half
+# of the largest range means that a turret looks at no more than 5x5 cells
+TURRET_GRID_CELL = max(TURRET_RANGE) / 2.0
+
+# a turret
+class Turret:
+	# create a turret
+	def __init__(self, variation, x, y):
+		self.variation = variation
+		self.x = x
+		self.y = y
+		self.direction = 13.14
+
+	# tick the turret
+	def tick(self):
+		self.direction += 0.0123
+
+# all trap types
+TRAP_SPIKE = 0
+TRAP_BOMB = 1
+
+# a trap
+class Trap:
+	# create a trap
+	def __init__(self, variation, x, y):
+		self.variation = variation
+		self.x = x
+		self.y = y
+		# damage dealt, used by spike traps only
+		self.dealt = 0.0
+		self.dead = False
+
+# a pool of things that are only for show, like bullets and particles. like
+# the enemies, every property of every thing is stored in its own contiguous
+# array (named in (fields) by each kind of pool), and the things that are in
+# use are the first (count) entries. unlike the enemies, the arrays are made
+# once at a fixed capacity and never grow, the free entries are simply the
+# ones after (count), and dead things are swept away by moving things from
+# the end into their places, so nothing is allocated while the game runs. if
+# the pool is full, the oldest things make room for new ones
+class Pool:
+	# the names of the arrays
+	fields = ()
+
+	# create an empty pool of (capacity) things. every kind of pool makes its
+	# arrays before calling this
+	def __init__(self, capacity):
+		self.capacity = capacity
+		self.count = 0
+		# the order in which the things were added, for evicting the oldest
+		self.born = np.zeros(capacity, dtype=np.int64)
+		self.serial = 0
+
+	# the number of things
+	def __len__(self):
+		return self.count
+
+	# remove all the things
+	def clear(self):
+		self.count = 0
+
+	# make room for (n) more things at the end, evicting the oldest things if
+	# the pool is full. returns the range (a, b) of the new entries, which is
+	# less than (n) long only if (n) is more than the whole capacity
+	def allocate(self, n):
+		n = min(n, self.capacity)
+		excess = self.count + n - self.capacity
+		if (excess > 0):
+			keep = np.ones(self.count, dtype=bool)
+			keep[np.argpartition(self.born[:self.count], excess - 1)[:excess]] = False
+			self.remove(keep)
+		a = self.count
+		b = a + n
+		self.born[a:b] = np.arange(self.serial, self.serial + n)
+		self.serial += n
+		self.count = b
+		return a, b
+
+	# remove every thing that (keep) is False for. the holes that that leaves
+	# are filled with the things at the end, so the order isn't kept
+	def remove(self, keep):
+		n = self.count
+		m = int(np.count_nonzero(keep))
+		if (m == n):
+			return
+		holes = np.flatnonzero(~keep[:m])
+		movers = np.flatnonzero(keep[m:n]) + m
+		for name in self.fields + ('born',):
+			array = getattr(self, name)
+			array[holes] = array[movers]
+		self.count = m
+
+# bullet constants
+BULLET_SPEED = 0.05
+BULLET_LENGTH = 10.0
+
+# the most bullets that can be flying at once
+BULLET_CAPACITY = 1024
+
+# all the bullets. these bullets are completely fake. since the game is fast
+# paced, it suffices to draw a ray that zooms in on a target, but the target
+# is damaged even before the ray hits it. in gameplay, these 'fake' bullets
+# are unnoticeable. each bullet flies from (x0, y0) to (x1, y1), and t is how
+# far along it is
+class BulletPool(Pool):
+	fields = ('x0', 'y0', 'x1', 'y1', 't')
+
+	# create an empty pool of bullets
+	def __init__(self, capacity=BULLET_CAPACITY):
+		self.x0 = np.zeros(capacity)
+		self.y0 = np.zeros(capacity)
+		self.x1 = np.zeros(capacity)
+		self.y1 = np.zeros(capacity)
+		self.t = np.zeros(capacity)
+		Pool.__init__(self, capacity)
+
+	# add a bullet
+	def add(self, x0, y0, x1, y1):
+		i = self.allocate(1)[0]
+		self.x0[i] = x0
+		self.y0[i] = y0
+		self.x1[i] = x1
+		self.y1[i] = y1
+		self.t[i] = 0.0
+
+	# move all the bullets at once
+	def tick(self):
+		self.t[:self.count] += BULLET_SPEED
+
+	# remove all the bullets that got where they were going
+	def compact(self):
+		self.remove(self.t[:self.count] < 1.0)
+
+# the most particles that can be alive at once
+PARTICLE_CAPACITY = 16384
+
+# the level of detail (quality) of the particles. it is 1 while there are no
+# more than half as many live particles as the particle system's budget, and
+# while frames take no more than PARTICLE_LOD_FAST of the frame budget. it
+# falls to PARTICLE_MIN_QUALITY as the live particles reach the budget, or
+# as frames take PARTICLE_LOD_SLOW of the frame budget. bursts get smaller and
+# particles live shorter with the quality, and below PARTICLE_BLEED_QUALITY
+# particles stop leaving blood. the frame time is smoothed by
+# PARTICLE_LOD_SMOOTHING so that one slow frame doesn't matter
+PARTICLE_MIN_QUALITY = 0.1
+PARTICLE_BLEED_QUALITY = 0.25
+PARTICLE_LOD_FAST = 0.75
+PARTICLE_LOD_SLOW = 1.25
+PARTICLE_LOD_SMOOTHING = 0.1
+
+# map (x) from 1 at (start) to PARTICLE_MIN_QUALITY at (end), linearly
+def lod_ramp(x, start, end):
+	return clamp(1.0 - (x - start) / (end - start) * (1.0 - PARTICLE_MIN_QUALITY), PARTICLE_MIN_QUALITY, 1.0)
+
+# a particle system. instead of having one object per particle, every property
+# of every particle is stored in its own contiguous array (see Pool). this way
+# all of the particles can be ticked at once using numpy, which is a lot
+# faster than ticking hundreds of particle objects one at a time
+class ParticleSystem(Pool):
+	# self.sx and self.sy are tracer positions used for blood tracing
+	fields = ('x', 'y', 'sx', 'sy', 'dx', 'dy', 'life', 'color')
+
+	# create an empty particle system
+	def __init__(self, capacity=PARTICLE_CAPACITY):
+		# particles are only for show, so a disabled particle system ignores
+		# any particles that are added to it
+		self.enabled = True
+		# the level of detail, see update_lod()
+		self.budget = capacity
+		self.quality = 1.0
+		self.frame_ms = 0.0
+		self.x = np.zeros(capacity)
+		self.y = np.zeros(capacity)
+		self.sx = np.zeros(capacity)
+		self.sy = np.zeros(capacity)
+		self.dx = np.zeros(capacity)
+		self.dy = np.zeros(capacity)
+		self.life = np.zeros(capacity, dtype=np.int32)
+		self.color = np.zeros((capacity, 3), dtype=np.uint8)
+		Pool.__init__(self, capacity)
+		self.seed(None)
+
+	# seed the random number generator that the particles are made with
+	def seed(self, seed):
+		self.rng = np.random.default_rng(seed)
+
+	# work out the level of detail from the number of live particles and, if
+	# (frame_ms) is given, how many milliseconds the last frame took
+	def update_lod(self, frame_ms=None):
+		if (frame_ms is not None):
+			self.frame_ms += (frame_ms - self.frame_ms) * PARTICLE_LOD_SMOOTHING
+		quality = lod_ramp(self.count / float(self.budget), 0.5, 1.0)
+		quality = min(quality, lod_ramp(self.frame_ms / FRAME_BUDGET, PARTICLE_LOD_FAST, PARTICLE_LOD_SLOW))
+		self.quality = quality
+
+	# get the number of particles that a burst of (n) particles has at the
+	# current level of detail. there is always at least one
+	def burst_size(self, n):
+		if (self.quality >= 1.0):
+			return n
+		return max(1, int(n * self.quality))
+
+	# add (n) particles at (x, y) flying in random directions. color can be a
+	# single color or an array of n colors, and power can be a single number
+	# or an array of n numbers
+	def add_burst(self, x, y, n, color=(255, 255, 255), power=5.0):
+		if (not self.enabled):
+			return
+		a, b = self.allocate(n)
+		n = b - a
+		if (np.ndim(color) == 2):
+			color = color[:n]
+		if (np.ndim(power) == 1):
+			power = power[:n]
+		direction = self.rng.random(n) * 360.0
+		length = self.rng.random(n) * power
+		self.x[a:b] = x
+		self.y[a:b] = y
+		self.sx[a:b] = x
+		self.sy[a:b] = y
+		self.dx[a:b] = np.sin(direction) * length
+		self.dy[a:b] = np.cos(direction) * length
+		life = self.rng.integers(10, 51, n)
+		if (self.quality < 1.0):
+			# particles live shorter at a lower level of detail
+			life = life * (0.5 + 0.5 * self.quality)
+		self.life[a:b] = life
+		self.color[a:b] = color
+
+	# add a single particle
+	def add(self, x, y, direction, color=(255, 255, 255), power=5.0):
+		if (not self.enabled):
+			return
+		i = self.allocate(1)[0]
+		length = self.rng.random() * power
+		self.x[i] = x
+		self.y[i] = y
+		self.sx[i] = x
+		self.sy[i] = y
+		self.dx[i] = math.sin(direction) * length
+		self.dy[i] = math.cos(direction) * length
+		life = self.rng.integers(10, 51)
+		if (self.quality < 1.0):
+			life = life * (0.5 + 0.5 * self.quality)
+		self.life[i] = life
+		self.color[i] = color
+
+	# tick all the particles at once
+	def tick(self, level):
+		n = self.count
+		if (n == 0):
+			return
+		drag = 0.9
+		dx = self.dx[:n]
+		dy = self.dy[:n]
+		dx *= drag
+		dy *= drag
+		self.x[:n] += dx
+		self.y[:n] += dy
+		# don't move the tracers that are in a wall. note that astype() rounds
+		# towards zero, just like int() does
+		sx = self.sx[:n]
+		sy = self.sy[:n]
+		tx = ((sx - level_offset_x) / tile_w).astype(np.int32)
+		ty = ((sy - level_offset_y) / tile_h).astype(np.int32)
+		inside = (tx >= 0) & (tx < level.w) & (ty >= 0) & (ty < level.h)
+		on_floor = np.zeros(n, dtype=bool)
+		on_floor[inside] = level.floor_mask()[ty[inside], tx[inside]]
+		sx[on_floor] += dx[on_floor]
+		sy[on_floor] += dy[on_floor]
+		self.life[:n] -= 1
+
+	# trace blood onto a level using the tracer positions. particles don't
+	# leave blood if the level of detail is too low
+	def bleed(self, level):
+		n = self.count
+		if (n > 0 and self.quality >= PARTICLE_BLEED_QUALITY):
+			level.add_blood(self.sx[:n], self.sy[:n], self.color[:n])
+
+	# remove all the dead particles in bulk
+	def compact(self):
+		self.remove(self.life[:self.count] >= 0)
+
+# the number of simulation steps per second. the game is simulated in steps
+# of a fixed length no matter how fast it is being drawn, so that it plays at
+# the same speed on slow and fast computers
+TICK_RATE = 60
+TICK_TIME = 1.0 / TICK_RATE
+
+# the order in which enemies are spawned
+spawner = [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2, 1, 2, 1, 2, 1, 2, 1, 2, 0, 0, 0, 0, 2, 2, 2, 2, 1, 1, 1, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1]
+
+# how long a level has to be survived for, in seconds
+GAME_LENGTH = 100
+
+# the price of each thing in the shops, indexed by the tile that is placed
+PRICE = {
+	TILE_PISTOL_TURRET: 50,
+	TILE_SHOTGUN_TURRET: 100,
+	TILE_UZI_TURRET: 150,
+	TILE_SPIKE_TRAP: 100,
+	TILE_BOMB_TRAP: 150
+}
+
+# the price of a health up, and how many steps it takes before another one
+# can be bought
+HEALTH_UP_PRICE = 50
+HEALTH_UP_COOLDOWN = 600
+
+# the names of the things in the shops, and the tile that each one places.
+# a health up doesn't place anything
+ITEM_HEALTH_UP = 'health_up'
+ITEMS = {
+	'pistol_turret': TILE_PISTOL_TURRET,
+	'shotgun_turret': TILE_SHOTGUN_TURRET,
+	'uzi_turret': TILE_UZI_TURRET,
+	'spike_trap': TILE_SPIKE_TRAP,
+	'bomb_trap': TILE_BOMB_TRAP
+}
+
+# the things a player can do, as recorded in a replay
+ACTION_BUY = 0
+ACTION_HEALTH_UP = 1
+ACTION_PLACE = 2
+# the player left the game before it was won or lost
+ACTION_QUIT = 3
+
+# a replay file starts with a header of a magic number, the format version,
+# the level number and the seed, then has one 10 byte record per action: the
+# tick it happened on, the action, an argument (the tile that was bought, or
+# whether the thing placed is kept in the player's 'hand') and a tile
+# position (two 16-bit integers, so big levels fit)
+REPLAY_MAGIC = b'BHRP'
+REPLAY_VERSION = 2
+REPLAY_HEADER = struct.Struct('<4sBBI')
+REPLAY_RECORD = struct.Struct('<IBBHH')
+
+# seeds are from 0 up to (but not including) this
+SEED_LIMIT = 1 << 32
+
+# parse a seed from the command line, for argparse
+def parse_seed(string):
+	seed = int(string)
+	if (seed < 0 or seed >= SEED_LIMIT):
+		raise argparse.ArgumentTypeError('a seed must be from 0 to ' + str(SEED_LIMIT - 1))
+	return seed
+
+# everything a player did in a game. the game is deterministic given its seed,
+# so this is all that is needed to play the game again exactly
+class Replay:
+	# create an empty replay
+	def __init__(self, level_num, seed):
+		self.level_num = level_num
+		self.seed = seed
+		# a list of (tick, action, argument, x, y) tuples, in order
+		self.actions = []
+
+	# record an action that happened before the step (tick). only actions
+	# that did something are recorded, so a failed purchase isn't
+	def record(self, tick, action, argument=0, x=0, y=0):
+		self.actions.append((tick, action, argument, x, y))
+
+	# save the replay to a file
+	def save(self, path):
+		with open(path, 'wb') as f:
+			f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.level_num, self.seed))
+			for i in range(0, len(self.actions)):
+				f.write(REPLAY_RECORD.pack(*self.actions[i]))
+
+	# load a replay from a file
+	@staticmethod
+	def load(path):
+		with open(path, 'rb') as f:
+			data = f.read()
+		magic, version, level_num, seed = REPLAY_HEADER.unpack_from(data, 0)
+		if (magic != REPLAY_MAGIC):
+			raise ValueError(path + ' is not a replay')
+		if (version != REPLAY_VERSION):
+			raise ValueError(path + ' was recorded by another version of the game')
+		replay = Replay(level_num, seed)
+		replay.actions = list(REPLAY_RECORD.iter_unpack(data[REPLAY_HEADER.size:]))
+		return replay
+
+# all the states that a game can be in
+STATE_PLAYING = 0
+STATE_WON = 1
+STATE_LOST = 2
+
+# the whole state of a game, and everything needed to simulate it
+class Engine:
+	# create a game on a level
+	def __init__(self, level, level_num, seed=None):
+		# the particles survive between levels, since the title screens
+		# use them too
+		self.particles = ParticleSystem()
+		self.bullets = BulletPool()
+		self.screenshake_x = 0.0
+		self.screenshake_y = 0.0
+		# the names of the sounds that should be played. whoever is showing
+		# the game plays them and clears this
+		self.sounds = []
+		# the profiler that the phases of each step are timed with. it does
+		# nothing unless whoever is showing the game turns it on
+		self.profiler = Profiler(enabled=False)
+		self.init_level(level, level_num, seed)
+
+	# initialize a level. (seed) seeds all the randomness of the game, so that
+	# the same seed and the same inputs always play out the same way. if it is
+	# None, a random seed is picked
+	def init_level(self, level, level_num, seed=None):
+		self.level = level
+		self.level_num = level_num
+		self.reseed(seed)
+		self.state = STATE_PLAYING
+		self.gold = 100
+		self.time = 0
+		self.cash = 150
+		self.ticks = 0
+		self.health_cooldown = 0
+		self.screenshake_x = 0.0
+		self.screenshake_y = 0.0
+		self.spawn = 0
+		self.enemies = EnemyPool()
+		self.bullets.clear()
+		self.turrets = []
+		self.traps = []
+		self.particles.clear()
+		# the thing that was bought and is now in the player's 'hand'
+		self.currently_placing_turret = False
+		self.currently_placing_turret_type = -1
+		self.stat_kills = 0
+		self.stat_turrets = 0
+		self.stat_traps = 0
+		self.stat_money = 0
+		self.stat_damage = 0
+		# everything the player did, so that the game can be replayed
+		self.replay = Replay(level_num, self.seed)
+		self.level.reset()
+
+	# seed the random number generators. the game itself draws from
+	# self.random, while anything that is only for show (particles,
+	# screenshake, ambient explosions) draws from self.effects and the particle
+	# system's own generator. this way turning the particles off doesn't change
+	# how the game plays out
+	def reseed(self, seed=None):
+		if (seed is None):
+			seed = random.randrange(0, SEED_LIMIT)
+		# seeds are stored in replays as 32-bit unsigned integers
+		seed %= SEED_LIMIT
+		self.seed = seed
+		self.random = random.Random(seed)
+		self.effects = random.Random(seed + 1)
+		self.particles.seed(seed)
+
+	# play a sound
+	def sound(self, sound_name):
+		self.sounds.append(sound_name)
+
+	# spawn an enemy
+	def spawn_enemy(self, variation, route=0):
+		self.enemies.spawn(variation, self.random.randint(0x0, 0xDEADBEEF), route, self.level.route_scale[route])
+
+	# add a turret
+	def add_turret(self, variation, x, y):
+		self.turrets.append(Turret(variation, x, y))
+
+	# add a trap
+	def add_trap(self, variation, x, y):
+		self.traps.append(Trap(variation, x, y))
+
+	# add a bullet
+	def add_bullet(self, x0, y0, x1, y1):
+		self.bullets.add(x0, y0, x1, y1)
+
+	# add a particle
+	def add_particle(self, x, y, direction, color=(255, 255, 255), power=5.0):
+		self.particles.add(x, y, direction, color, power)
+
+	# add a random ambient particle
+	def add_random_ambient_particle(self, color=(255, 255, 255), power=5.0):
+		self.particles.add(self.effects.randint(0, window_w), self.effects.randint(0, window_h), self.effects.random() * 360.0, color, power)
+
+	# add a particle burst
+	def add_particle_burst(self, x, y, color=(255, 255, 255), power=5.0):
+		self.particles.add_burst(x, y, self.particles.burst_size(100), color, power)
+
+	# add a tiny particle burst
+	def add_tiny_particle_burst(self, x, y, color=(255, 255, 255), power=2.0):
+		self.particles.add_burst(x, y, self.particles.burst_size(10), color, power)
+
+	# add an enemy explosion
+	def add_enemy_explosion(self, x, y, color=(255, 255, 255), power=5.0):
+		self.particles.add_burst(x, y, self.particles.burst_size(300), color, power)
+
+	# add an explosion
+	def add_explosion(self, x, y):
+		SHAKE_POWER = 100.0
+		self.screenshake_x = signed_rand(self.effects) * SHAKE_POWER
+		self.screenshake_y = signed_rand(self.effects) * SHAKE_POWER
+		n = self.particles.burst_size(500)
+		g = self.particles.rng.integers(0, 256, n)
+		color = np.stack((np.clip(g * 10, 0, 255), np.clip(g * 2, 0, 255), g), axis=1)
+		self.particles.add_burst(x, y, n, color, self.particles.rng.random(n) * 15.0)
+
+	# add a gold explosion
+	def add_gold_explosion(self, x, y):
+		SHAKE_POWER = 25.0
+		self.screenshake_x = signed_rand(self.effects) * SHAKE_POWER
+		self.screenshake_y = signed_rand(self.effects) * SHAKE_POWER
+		n = self.particles.burst_size(250)
+		g = self.particles.rng.integers(0, 256, n)
+		color = np.stack((np.clip(g * 5, 0, 255), np.clip(g * 5, 0, 255), g), axis=1)
+		self.particles.add_burst(x, y, n, color, self.particles.rng.random(n) * 7.5)
+
+	# purchase an item for x dollars if there is at least that much cash
+	# available. return True if the item was purchased
+	def purchase_if_possible(self, x):
+		if (self.cash >= x):
+			self.cash -= x
+			self.stat_money += x
+			self.sound('purchase')
+			return True
+		self.sound('failed_purchase')
+		return False
+
+	# buy a turret or trap (given as the tile it places) and put it in the
+	# player's 'hand', if nothing is there yet. return True if it was bought
+	def buy(self, tile):
+		if (self.currently_placing_turret):
+			return False
+		if (self.purchase_if_possible(PRICE[tile])):
+			self.replay.record(self.ticks, ACTION_BUY, tile)
+			self.currently_placing_turret = True
+			self.currently_placing_turret_type = tile
+			return True
+		return False
+
+	# buy a health up, if nothing is in the player's 'hand' and the health up
+	# isn't cooling down. return True if it was bought
+	def buy_health_up(self):
+		if (self.currently_placing_turret or self.health_cooldown != 0):
+			return False
+		self.sound('heal')
+		if (self.purchase_if_possible(HEALTH_UP_PRICE)):
+			self.replay.record(self.ticks, ACTION_HEALTH_UP)
+			self.gold += 15
+			if (self.gold > 100):
+				self.gold = 100
+			# set the health cooldown so that you can't use a ton of
+			# health-ups in a row
+			self.health_cooldown = HEALTH_UP_COOLDOWN
+			return True
+		return False
+
+	# returns True if the thing in the player's 'hand' can be placed on the
+	# tile (tx, ty)
+	def can_place(self, tx, ty):
+		if (not self.currently_placing_turret):
+			return False
+		return self.can_place_tile(self.currently_placing_turret_type, tx, ty)
+
+	# returns True if a turret/trap (given as the tile it places) can be
+	# placed on the tile (tx, ty)
+	def can_place_tile(self, t, tx, ty):
+		if (tx < 0 or tx >= self.level.w or ty < 0 or ty >= self.level.h):
+			return False
+		tile = self.level.peek(tx, ty)
+		if (can_be_placed_on_wall(t)):
+			# make sure the tile is a wall tile
+			return tile == TILE_WALL
+		elif (can_be_placed_on_floor(t)):
+			# make sure the tile is a floor tile
+			return tile == TILE_FLOOR
+		return False
+
+	# place the thing in the player's 'hand' on the tile (tx, ty). if (keep)
+	# is True, the thing stays in the player's 'hand' afterwards (that's a
+	# cheat). return True if it was placed
+	def place(self, tx, ty, keep=False):
+		if (not self.can_place(tx, ty)):
+			return False
+		self.replay.record(self.ticks, ACTION_PLACE, int(keep), tx, ty)
+		t = self.currently_placing_turret_type
+		self.add_particle_burst(level_offset_x + tx * tile_w + tile_w / 2, level_offset_y + ty * tile_h + tile_h / 2)
+		if (can_be_placed_on_wall(t)):
+			self.sound('place_turret')
+			self.stat_turrets += 1
+			# note that the turret type enumerations are sequential, so doing
+			# this is kind of hacky but still valid
+			self.add_turret(t - TILE_PISTOL_TURRET, tx, ty)
+		else:
+			self.sound('place_trap')
+			self.stat_traps += 1
+			# note that the trap type enumerations are sequential, so doing
+			# this is kind of hacky but still valid
+			self.add_trap(t - TILE_SPIKE_TRAP, tx, ty)
+		self.level.poke(tx, ty, t)
+		if (not keep):
+			self.currently_placing_turret = False
+		return True
+
+	# buy something by name (see ITEMS) and place it on the tile (tx, ty) in
+	# one go. if it can't be placed there, it stays in the player's 'hand'.
+	# return True if it was bought (and placed)
+	def buy_and_place(self, item, tx, ty):
+		if (item == ITEM_HEALTH_UP):
+			return self.buy_health_up()
+		if (not self.buy(ITEMS[item])):
+			return False
+		return self.place(tx, ty)
+
+	# do one step of the game simulation
+	def step(self):
+		lap = self.profiler.lap
+
+		# go to the lose screen if we lost
+		if (self.gold < 0):
+			self.state = STATE_LOST
+			self.sound('level_fail')
+
+		# get the elapsed time
+		self.time = self.ticks // TICK_RATE
+
+		# go to the win screen if we won
+		if (self.time >= GAME_LENGTH):
+			self.state = STATE_WON
+			self.sound('level_pass')
+
+		level = self.level
+		enemies = self.enemies
+
+		# move the enemies
+		enemies.tick()
+		n = enemies.count
+
+		# get the pixel positions of each enemy all at once
+		progress = enemies.position[:n]
+		route = enemies.route[:n]
+		path_x, path_y = level.positions(progress, route)
+		enemy_x = path_x * tile_w + level_offset_x
+		enemy_y = path_y * tile_h + level_offset_y
+
+		# get the positions of each enemy a little bit in the future. this
+		# prediction is extremely accurate
+		path_x, path_y = level.positions(progress + enemies.speed[:n] * (1.0 / BULLET_SPEED), route)
+		enemy_next_x = path_x * tile_w + level_offset_x + 8
+		enemy_next_y = path_y * tile_h + level_offset_y + 8
+
+		# periodically damage the gold with the enemies that are sitting on it
+		for i in enemies.gold_contacts(self.ticks, level.gold_progress).tolist():
+			damage = E_BASE_DAMAGE * E_DAMAGE[enemies.variation[i]]
+			self.add_gold_explosion(enemy_x[i] + signed_rand(self.random) * tile_w + 8.0, enemy_y[i] + signed_rand(self.random) * tile_h + 8.0)
+			self.gold -= damage
+			self.stat_damage += damage
+			self.sound('gold_damage')
+
+		# check for dead enemies
+		dead = enemies.dead()
+		if (len(dead) > 0):
+			for i in dead.tolist():
+				# if the enemy died, do an explosion and give the player some
+				# money
+				v = enemies.variation[i]
+				self.add_enemy_explosion(enemy_x[i] + 8, enemy_y[i] + 8, E_COLOR[v])
+				self.cash += E_LOOT[v]
+				self.sound('enemy_die')
+				self.stat_kills += 1
+
+			# remove dead enemies, along with their positions
+			alive = enemies.health[:n] > 0
+			enemies.compact()
+			enemy_x = enemy_x[alive]
+			enemy_y = enemy_y[alive]
+			enemy_next_x = enemy_next_x[alive]
+			enemy_next_y = enemy_next_y[alive]
+		enemy_positions = list(zip((enemy_x + 8).tolist(), (enemy_y + 8).tolist()))
+		enemy_next_positions = list(zip(enemy_next_x.tolist(), enemy_next_y.tolist()))
+		health = enemies.health
+		lap('sim.enemies')
+
+		# tick the turrets
+		for i in range(0, len(self.turrets)):
+			self.turrets[i].tick()
+		lap('sim.turrets')
+
+		# tick the bullets, and remove the dead ones
+		self.bullets.tick()
+		self.bullets.compact()
+		lap('sim.bullets')
+
+		# put the enemies into a grid so that turrets can find targets quickly.
+		# a turret aims at the nearest enemy, but checks its range against
+		# where that enemy will be, which is up to (enemy_lead) further on
+		enemy_grid = SpatialGrid(enemy_positions, TURRET_GRID_CELL)
+		enemy_lead = 0.0
+		if (len(enemy_positions) > 0):
+			enemy_lead = float(np.hypot(enemy_next_x - (enemy_x + 8), enemy_next_y - (enemy_y + 8)).max())
+
+		# do turret AI
+		for i in range(0, len(self.turrets)):
+			turret = self.turrets[i]
+			tv = turret.variation
+			if (len(enemy_positions) > 0):
+				tx = turret.x * tile_w + level_offset_x + 8
+				ty = turret.y * tile_h + level_offset_y + 8
+				t = (tx, ty)
+				# find the index of the nearest enemy. only enemies that are
+				# close enough to walk into range are looked for, since the
+				# turret can't shoot any other enemy. if there isn't one, the
+				# turret just idles
+				e = enemy_grid.nearest_within(t, TURRET_RANGE[tv] + enemy_lead + 1.0)
+				if (e == -1):
+					continue
+				# find the distance to the nearest enemy's future position
+				p = enemy_next_positions[e]
+				d = dist(t, p)
+				# point towards that enemy
+				turret.direction = angle_to(t, p)
+				# check if the enemy is in range
+				if (d < TURRET_RANGE[tv]):
+					# check if the turret can shoot. this is basically checking
+					# if the step number plus a scrambled offset is a multiple
+					# of (cooldown), which makes the turret shoot every
+					# (cooldown) steps
+					cooldown = TURRET_COOLDOWN[tv]
+					if ((self.ticks + i * 1337) % cooldown == 0):
+						# shoot as many bullets as required
+						for z in range(0, TURRET_BULLETS[tv]):
+							# shoot a bullet and weaken the enemy
+							self.add_bullet(t[0], t[1], p[0] + signed_rand(self.random) * TURRET_ACCURACY[tv], p[1] + signed_rand(self.random) * TURRET_ACCURACY[tv])
+							health[e] -= TURRET_BASE_DAMAGE * TURRET_DAMAGE[tv]
+						# play the correct sound
+						if (tv == TURRET_PISTOL):
+							self.sound('turret_pistol')
+						elif (tv == TURRET_SHOTGUN):
+							self.sound('turret_shotgun')
+						elif (tv == TURRET_UZI):
+							self.sound('turret_uzi')
+		lap('sim.turret_ai')
+
+		# put the enemies into buckets by the tile they are standing on, so
+		# that each trap only has to look at the enemies on its own tile
+		enemy_tiles = {}
+		for j in range(0, len(enemy_positions)):
+			key = (int((enemy_positions[j][0] - level_offset_x) // tile_w), int((enemy_positions[j][1] - level_offset_y) // tile_h))
+			bucket = enemy_tiles.get(key)
+			if (bucket is None):
+				enemy_tiles[key] = [j]
+			else:
+				bucket.append(j)
+
+		# do trap AI
+		for i in range(0, len(self.traps)):
+			trap = self.traps[i]
+			for j in enemy_tiles.get((trap.x, trap.y), []):
+				px = enemy_positions[j][0]
+				py = enemy_positions[j][1]
+				# activate the trap
+				if (trap.variation == TRAP_SPIKE):
+					# deal out some damage
+					health[j] -= 1.0
+					trap.dealt += 1.0
+					# if the trap dealt enough damage, kill it
+					if (trap.dealt > 10.0):
+						self.add_particle_burst(px, py)
+						trap.dead = True
+					self.sound('enemy_hit')
+				elif (trap.variation == TRAP_BOMB):
+					# cause an explosion and obliterate the enemy
+					self.add_explosion(px, py)
+					health[j] -= 9999.0
+					trap.dead = True
+			# if the trap was killed then remove it from the map
+			if (trap.dead):
+				level.poke(trap.x, trap.y, TILE_FLOOR)
+
+		# remove dead traps
+		self.traps = [i for i in self.traps if i.dead == False]
+		lap('sim.trap_ai')
+
+		# tick the particles and trace their blood, then remove the dead ones
+		self.particles.update_lod()
+		self.particles.tick(level)
+		self.particles.bleed(level)
+		self.particles.compact()
+		lap('sim.particles')
+
+		# lower the health cooldown
+		if (self.health_cooldown > 0):
+			self.health_cooldown -= 1
+
+		# do spawning
+		if (self.ticks % 50 == 0):
+			self.spawn += 1
+			# take turns spawning on each route
+			self.spawn_enemy(spawner[(self.spawn - 1) % len(spawner)], (self.spawn - 1) % len(self.level.routes))
+
+		self.ticks += 1
+		lap('sim.spawn')
+
+# load the level with the given number (starting at 1)
+def load_level(level_num):
+	return Level('level' + str(level_num) + '.txt')
+
+# simulate a level without a display as fast as possible, until it is won or
+# lost. nobody can see the particles, so they are turned off. (purchases) is
+# a list of (tick, item, x, y) tuples, sorted by tick. each purchase is tried
+# from its tick onwards until there is enough cash for it, just like a player
+# waiting for money would. returns the engine, so that the results can be
+# looked at. (seed) seeds the game, see Engine.init_level()
+def simulate(level_num, purchases=(), seed=None):
+	game = Engine(load_level(level_num), level_num, seed)
+	game.particles.enabled = False
+	game.purchases_made = 0
+	i = 0
+	while (game.state == STATE_PLAYING):
+		while (i < len(purchases) and purchases[i][0] <= game.ticks):
+			tick, item, x, y = purchases[i]
+			if (item != ITEM_HEALTH_UP and not game.can_place_tile(ITEMS[item], x, y)):
+				# it can never be placed there, so give up on it
+				i += 1
+			elif (game.buy_and_place(item, x, y)):
+				game.purchases_made += 1
+				i += 1
+			else:
+				break
+		game.step()
+		game.sounds.clear()
+	return game
+
+# play a replay without a display as fast as possible, until the game is won
+# or lost, or until the player left it. every action is done right before the step it was recorded before,
+# so the game plays out exactly like it did when it was recorded. returns the
+# engine, so that the results can be looked at
+def play_replay(replay):
+	game = Engine(load_level(replay.level_num), replay.level_num, replay.seed)
+	game.particles.enabled = False
+	actions = replay.actions
+	i = 0
+	while (game.state == STATE_PLAYING):
+		while (i < len(actions) and actions[i][0] <= game.ticks):
+			tick, action, argument, x, y = actions[i]
+			if (action == ACTION_BUY):
+				game.buy(argument)
+			elif (action == ACTION_HEALTH_UP):
+				game.buy_health_up()
+			elif (action == ACTION_PLACE):
+				game.place(x, y, argument != 0)
+			elif (action == ACTION_QUIT):
+				return game
+			i += 1
+		game.step()
+		game.sounds.clear()
+	return game
@@ -1,13 +1,56 @@
 # Bank Heist by Adam Sidat
 
 import os
+import sys
 import math
 import time
+import numpy as np
 import pygame
 import random
 import pickle
 import colorsys
-import datetime
+import argparse
+import threading
+import collections
+from engine import *
+from profiler import *
+
+# parse the command line arguments
+parser = argparse.ArgumentParser(description='Bank Heist, a tower defence game')
+parser.add_argument('--headless', action='store_true', help='simulate a level without a display or sound, as fast as possible, then print the results and quit. can also be enabled by setting BANK_HEIST_HEADLESS=1')
+parser.add_argument('--level', type=int, default=1, choices=[1, 2, 3], help='the level to simulate in headless mode')
+parser.add_argument('--seed', type=parse_seed, default=None, help='seed the game, so that it plays out the same way every time')
+parser.add_argument('--record', metavar='PATH', help='save a replay of each game that is played to this file, overwriting the last one')
+parser.add_argument('--replay', metavar='PATH', help='play a replay in headless mode, then print the results and quit')
+parser.add_argument('--hardware-scaling', action='store_true', help='let the graphics card scale the game up instead of doing it in software')
+parser.add_argument('--profile', metavar='PATH', default='profile.csv', help='the file that the frame profile is saved to when F4 is pressed. it is JSON if the name ends in .json, and CSV otherwise')
+args = parser.parse_args()
+
+# in headless mode there is no window, no sound and no font. the level is
+# simulated by the engine as fast as possible, the results are printed and
+# that's it. nothing else in this file is needed for that, and the
+# preferences are left alone
+headless = args.headless or os.environ.get('BANK_HEIST_HEADLESS', '0') not in ('', '0')
+if (headless or args.replay is not None):
+	time0 = time.perf_counter()
+	if (args.replay is not None):
+		try:
+			replay = Replay.load(args.replay)
+		except (OSError, ValueError) as e:
+			sys.exit(str(e))
+		game = play_replay(replay)
+	else:
+		game = simulate(args.level, seed=args.seed)
+	elapsed = time.perf_counter() - time0
+	if (game.state == STATE_WON):
+		print('level', game.level_num, 'won')
+	elif (game.state == STATE_LOST):
+		print('level', game.level_num, 'lost')
+	else:
+		print('level', game.level_num, 'left')
+	print('seed', game.seed, 'steps', game.ticks, 'took', elapsed, 'seconds')
+	print('gold', game.gold, 'cash', game.cash, 'kills', game.stat_kills, 'damage', game.stat_damage)
+	sys.exit()
 
 # local settings and preferences
 default_preferences = {
@@ -30,95 +73,10 @@ else:
 def level_unlocked(level):
 	return level <= preferences['levels_unlocked']
 
-# the following are math functions. these are used all over the program so it
-# makes sense to define them first
-
-# checks if a point is within an axis-aligned bounding box (AABB)
-def in_aabb_raw(x, y, aabbx, aabby, aabbw, aabbh):
-	# do 1-dimensional overlap checks
-	x1d = x >= aabbx and x <= aabbx + aabbw
-	y1d = y >= aabby and y <= aabby + aabbh
-	return x1d and y1d
-
-# checks if a point is within an axis-aligned bounding box (AABB), but uses an
-# object-oriented approach instead
-def in_aabb(point, aabb):
-	# do 1-dimensional overlap checks
-	x1d = point[0] >= aabb[0] and point[0] <= aabb[0] + aabb[2]
-	y1d = point[1] >= aabb[1] and point[1] <= aabb[1] + aabb[3]
-	return x1d and y1d
-
-# gets the time in milliseconds (for timing)
-def ms():
-	return datetime.datetime.now().microsecond / 1000.0
-
-# gets the time in seconds (for timing)
-def seconds():
-	return int(time.time())
-
-# gets the time in seconds with high precision
+# gets the time in seconds with high precision. this clock never goes
+# backwards, so it is safe to measure elapsed time with it
 def seconds_float():
-	return time.time()
-
-# clamp a value so it is not less than min or greater than max
-def clamp(x, _min, _max):
-	if (x < _min):
-		x = _min
-	elif (x > _max):
-		x = _max
-	return x
-
-# linearly interpolate between two points
-def lerp(p0, p1, x):
-	_x = p0[0] + (p1[0] - p0[0]) * x
-	_y = p0[1] + (p1[1] - p0[1]) * x
-	return (_x, _y)
-
-# get an angle (p) in radians such that sin(p)=x and cos(p)=y
-def angle(x, y):
-	return math.atan2(x, y)
-
-# find the squared distance between two points
-def dist2(a, b):
-	dx = b[0] - a[0]
-	dy = b[1] - a[1]
-	return dx * dx + dy * dy
-
-# find the distance between two points
-def dist(a, b):
-	dx = b[0] - a[0]
-	dy = b[1] - a[1]
-	return math.sqrt(dx * dx + dy * dy)
-
-# find the normal/unit vector to get from one point to another. this is
-# defined for a normal/unit vector (u) such that a+u*dist(a,b)=b
-def unit(a, b):
-	dx = b[0] - a[0]
-	dy = b[1] - a[1]
-	l = math.sqrt(dx * dx + dy * dy)
-	return (dx / l, dy / l)
-
-# find the angle from one point to another
-def angle_to(a, b):
-	u = unit(a, b)
-	return math.atan2(u[0], u[1])
-
-# get a signed random number
-def signed_rand():
-	return random.random() * 2.0 - 1.0
-
-# find the index of the nearest point in the array (a) to the point (p). as an
-# optimization to avoid calling math.sqrt(), the dist2() function is used
-# instead of dist()
-def nearest_to(p, a):
-	lowest_distance = 999999999.0
-	lowest_index = -1
-	for i in range(0, len(a)):
-		d = dist2(p, a[i])
-		if (d < lowest_distance):
-			lowest_distance = d
-			lowest_index = i
-	return lowest_index
+	return time.perf_counter()
 
 # format an integer so that it takes up n decimal places (right-aligned) and
 # return the result as a string. this is difficult to explain in a comment, so
@@ -143,25 +101,17 @@ def obfuscate_if_negative(x):
 # general constants
 gfx_scale = 2
 
-# tile sizing constants
-tile_w = 16
-tile_h = 16
-
-# level sizing constants
-level_w = 20
-level_h = 15
-
-# window sizing constants
-window_border_x = 4
-window_border_y = 4
-window_tile_w = 25
-window_tile_h = 20
-window_w = window_border_x * 2 + window_tile_w * tile_w
-window_h = window_border_y * 2 + window_tile_h * tile_h
-
-# initialize pygame
+# initialize pygame. with hardware scaling, the screen is as big as the game
+# and SDL scales it up when it is shown. otherwise the screen is (gfx_scale)
+# times bigger and the game is scaled up in software. (screen_scale) is how
+# many screen pixels there are per game pixel
 pygame.init()
-screen = pygame.display.set_mode((window_w * gfx_scale, window_h * gfx_scale))
+if (args.hardware_scaling):
+	screen = pygame.display.set_mode((window_w, window_h), pygame.SCALED)
+	screen_scale = 1
+else:
+	screen = pygame.display.set_mode((window_w * gfx_scale, window_h * gfx_scale))
+	screen_scale = gfx_scale
 pygame.display.set_caption('Bank Heist')
 
 # have some global state variables so that querying the mouse is simpler
@@ -170,8 +120,12 @@ mouse_left_pressed = False
 mouse_right_pressed = False
 
 # create a surface to draw to. draw to this instead of the main surface
-# since that makes scaling a lot easier
-surface = pygame.Surface((window_w, window_h))
+# since that makes scaling a lot easier. with hardware scaling there is
+# nothing to scale, so the game is drawn straight onto the screen
+if (screen_scale == 1):
+	surface = screen
+else:
+	surface = pygame.Surface((window_w, window_h))
 
 # the following are wrapper functions, because pygame's naming convention is
 # horrendous and inconsistent
@@ -184,18 +138,36 @@ def load_image(path):
 def draw_image(image, x, y):
 	surface.blit(image, (x, y))
 
+# the size of a progress bar, and how many different amounts of fill a
+# progress bar can show
+PROGRESS_BAR_W = 14
+PROGRESS_BAR_H = 3
+PROGRESS_BAR_LEVELS = 64
+
+# draw every progress bar that can be shown onto one image, one above the
+# other from empty to full, so that drawing a progress bar is a single blit
+def make_progress_bar_atlas():
+	atlas = pygame.Surface((PROGRESS_BAR_W, PROGRESS_BAR_H * PROGRESS_BAR_LEVELS)).convert()
+	for i in range(0, PROGRESS_BAR_LEVELS):
+		f = i / (PROGRESS_BAR_LEVELS - 1.0)
+		y = i * PROGRESS_BAR_H
+		atlas.fill((15, 15, 15), (0, y, PROGRESS_BAR_W, PROGRESS_BAR_H))
+		# make the progress bar fade from green to yellow to red, using HSV
+		# to RGB conversions should make this a lot easier
+		color = colorsys.hsv_to_rgb(1.0 / 3.0 * f, 1.0, 1.0)
+		color_rgb = (color[0] * 255, color[1] * 255, color[2] * 255)
+		atlas.fill(color_rgb, (0, y, int(PROGRESS_BAR_W * f), PROGRESS_BAR_H))
+	return atlas
+
+progress_bar_atlas = make_progress_bar_atlas()
+
 # draw a progress bar
 def draw_progress_bar(x, y, low, high, value):
-	# convert the progress bar value to a scalar
+	# convert the progress bar value to a scalar, then to the closest amount
+	# of fill that is in the atlas
 	f = clamp((value - low) / (high - low), 0.0, 1.0)
-	pb_w = 14.0
-	pb_h = 3.0
-	pygame.draw.rect(surface, (15, 15, 15), (x, y, pb_w, pb_h))
-	# make the progress bar fade from green to yellow to red, using HSV to RGB
-	# conversions should make this a lot easier
-	color = colorsys.hsv_to_rgb(1.0 / 3.0 * f, 1.0, 1.0)
-	color_rgb = (color[0] * 255, color[1] * 255, color[2] * 255)
-	pygame.draw.rect(surface, color_rgb, (x, y, pb_w * f, pb_h))
+	i = int(f * (PROGRESS_BAR_LEVELS - 1) + 0.5)
+	surface.blit(progress_bar_atlas, (x, y), (0, i * PROGRESS_BAR_H, PROGRESS_BAR_W, PROGRESS_BAR_H))
 
 # a subset of an image
 class Subimage:
@@ -211,10 +183,6 @@ def draw_subimage(subimage, x, y):
 def load_sound(path):
 	return pygame.mixer.Sound(path)
 
-# play a sound
-def play_sound(sound):
-	sound.play()
-
 # load tileset
 tileset_image = load_image('tileset.png')
 
@@ -227,31 +195,6 @@ tiles = []
 for i in range(0, 10):
 	tiles.append(generate_tile_image(i))
 
-# generate enumeration values for each tile
-TILE_WALL = 0
-TILE_FLOOR = 1
-TILE_PISTOL_TURRET = 2
-TILE_SHOTGUN_TURRET = 3
-TILE_UZI_TURRET = 4
-TILE_GOLD = 5
-TILE_SPIKE_TRAP = 6
-TILE_BOMB_TRAP = 7
-TILE_SPAWN = 8
-TILE_NOPE = 9
-
-# returns True if a turret/trap can be placed on a wall
-def can_be_placed_on_wall(t):
-	return t == TILE_PISTOL_TURRET or \
-	       t == TILE_SHOTGUN_TURRET or \
-	       t == TILE_UZI_TURRET or \
-	       t == TILE_WALL
-
-# returns True if a turret/trap can be placed on the floor
-def can_be_placed_on_floor(t):
-	return t == TILE_SPIKE_TRAP or \
-	       t == TILE_BOMB_TRAP or \
-	       t == TILE_FLOOR
-
 # generate numeric tiles
 numeric = []
 for i in range(0, 10):
@@ -335,514 +278,194 @@ gui_pricing2 = load_image('pricing2.png')
 gui_heads_up = load_image('heads_up.png')
 gui_title_tile = load_image('title_tile.png')
 
-# load the title image as a list of tiles
-title_tiles = []
-title_image = load_image('title.png')
-title_size = title_image.get_size()
-for i in range(0, title_size[0]):
-	for j in range(0, title_size[1]):
-		color = title_image.get_at((i, j))
-		if (color[0] > 0):
-			# not black, it's a background pixel
-			pass
-		else:
-			# probably black, it's a foreground pixel
-			title_tiles.append((i - (title_size[0] - 1) / 2, j - (title_size[1] - 1) / 2))
-
-# load the you win image as a list of tiles
-you_win_tiles = []
-you_win_image = load_image('you_win.png')
-you_win_size = you_win_image.get_size()
-for i in range(0, you_win_size[0]):
-	for j in range(0, you_win_size[1]):
-		color = you_win_image.get_at((i, j))
-		if (color[0] > 0):
-			# not black, it's a background pixel
-			pass
-		else:
-			# probably black, it's a foreground pixel
-			you_win_tiles.append((i - (you_win_size[0] - 1) / 2, j - (you_win_size[1] - 1) / 2))
-
-# load the you lose image as a list of tiles
-you_lose_tiles = []
-you_lose_image = load_image('you_lose.png')
-you_lose_size = you_lose_image.get_size()
-for i in range(0, you_lose_size[0]):
-	for j in range(0, you_lose_size[1]):
-		color = you_lose_image.get_at((i, j))
-		if (color[0] > 0):
-			# not black, it's a background pixel
-			pass
-		else:
-			# probably black, it's a foreground pixel
-			you_lose_tiles.append((i - (you_lose_size[0] - 1) / 2, j - (you_lose_size[1] - 1) / 2))
+# load an image as a list of tiles, one for each black pixel. the tiles are
+# relative to the center of the image
+def load_image_tiles(path):
+	# the tiles only change if the image does, so they are cached by the
+	# image's hash
+	name = 'tiles_' + hash_file(path) + '.dat'
+	out = load_cached(name)
+	if (out is not None):
+		return out
+	image = load_image(path)
+	size = image.get_size()
+	# anything that isn't black is a background pixel, and anything that
+	# probably is black is a foreground pixel. the red channel is indexed by
+	# [x, y], so the foreground pixels come out column by column
+	xs, ys = np.nonzero(pygame.surfarray.array_red(image) == 0)
+	xs = xs - (size[0] - 1) / 2
+	ys = ys - (size[1] - 1) / 2
+	out = list(zip(xs.tolist(), ys.tolist()))
+	save_cached(name, out)
+	return out
+
+# load the title, you win and you lose images as lists of tiles
+title_tiles = load_image_tiles('title.png')
+you_win_tiles = load_image_tiles('you_win.png')
+you_lose_tiles = load_image_tiles('you_lose.png')
 
 # calculate the title offset
 title_offset_x = window_w / 2
 title_offset_y = 100
 center_title_offset_y = 75
 
-# load a file as a list of strings (one for each line)
-def load_file(path):
-	return open(path).readlines()
-
-# a level
-class Level:
-	# load a level from a file
-	def __init__(self, path):
-		lines = load_file(path)
-		self.data = []
-		self.original_data = []
-		for j in range(0, level_h):
-			line = lines[j]
-			for i in range(0, level_w):
-				character = line[i]
-				if (character == '#'):
-					self.data.append(TILE_WALL)
-					self.original_data.append(TILE_WALL)
-				elif (character == 'G'):
-					self.data.append(TILE_GOLD)
-					self.original_data.append(TILE_GOLD)
-				elif (character == 'S'):
-					self.data.append(TILE_SPAWN)
-					self.original_data.append(TILE_SPAWN)
-				else:
-					self.data.append(TILE_FLOOR)
-					self.original_data.append(TILE_FLOOR)
-
-		# calculate the path to traverse the level
-		self.calculate_path()
-
-		# create a surface for the blood effects
-		self.blood = pygame.Surface((window_w, window_h), flags=pygame.SRCALPHA)
-		self.clear_up_the_bloody_floor_please_and_thank_you()
-
-	# don't ask
-	def clear_up_the_bloody_floor_please_and_thank_you(self):
-		# fill the blood effect surface with a transparent color
-		self.blood.fill((0, 0, 0, 0), (0, 0, window_w, window_h))
-  
-	# reset the level
-	def reset(self):
-		self.clear_up_the_bloody_floor_please_and_thank_you()
-		self.data = []
-		for i in range(0, len(self.original_data)):
-			self.data.append(self.original_data[i])
-
-	# calculate the path to traverse this level
-	def calculate_path(self):
-		# find the spawn tile
-		for j in range(0, level_h):
-			for i in range(0, level_w):
-				if (self.peek(i, j) == TILE_SPAWN):
-					spawn_x = i
-					spawn_y = j
-		# store the current previous tile position
-		prev_x = spawn_x
-		prev_y = spawn_y
-		curr_x = spawn_x
-		curr_y = spawn_y
-		# keep going until the gold tile is found
-		pathway = []
-		while True:
-			# generate tile coordinates
-			left_x = curr_x - 1
-			left_y = curr_y
-			right_x = curr_x + 1
-			right_y = curr_y
-			top_x = curr_x
-			top_y = curr_y - 1
-			bottom_x = curr_x
-			bottom_y = curr_y + 1
-			# get the tile types of each of these tiles
-			left = self.peek(left_x, left_y)
-			right = self.peek(right_x, right_y)
-			top = self.peek(top_x, top_y)
-			bottom = self.peek(bottom_x, bottom_y)
-			# check if any of these are gold
-			found_gold = False
-			if (left == TILE_GOLD): found_gold = True; gold_x = left_x; gold_y = left_y
-			if (right == TILE_GOLD): found_gold = True; gold_x = right_x; gold_y = right_y
-			if (top == TILE_GOLD): found_gold = True; gold_x = top_x; gold_y = top_y
-			if (bottom == TILE_GOLD): found_gold = True; gold_x = bottom_x; gold_y = bottom_y
-			# check if gold was found
-			if (found_gold):
-				# done
-				pathway.append((gold_x, gold_y))
-				self.gold_x = gold_x
-				self.gold_y = gold_y
-				break
-			# guess no gold was found, check if there is an empty tile that is
-			# not the previous tile
-			floor_x = -1
-			floor_y = -1
-			if (left == TILE_FLOOR and not (left_x == prev_x and left_y == prev_y)):
-				floor_x = left_x; floor_y = left_y
-			if (right == TILE_FLOOR and not (right_x == prev_x and right_y == prev_y)):
-				floor_x = right_x; floor_y = right_y
-			if (top == TILE_FLOOR and not (top_x == prev_x and top_y == prev_y)):
-				floor_x = top_x; floor_y = top_y
-			if (bottom == TILE_FLOOR and not (bottom_x == prev_x and bottom_y == prev_y)):
-				floor_x = bottom_x; floor_y = bottom_y
-			# check if there was an empty tile
-			if (floor_x != -1):
-				prev_x = curr_x
-				prev_y = curr_y
-				pathway.append((prev_x, prev_y))
-				curr_x = floor_x
-				curr_y = floor_y
-			else:
-				print('bad level')
-				exit()
-
-		# store the pathway
-		self.pathway = pathway
-
-	# get the position along the pathway based on a scalar x. that is, if x is
-	# 0, the the first position along the pathway will be returned. if x is 1,
-	# the last position along the pathway will be returned. if x is somewhere
-	# in the middle, it's value is interpolated from given data
-	def pos(self, x):
-		i = clamp(x * (len(self.pathway) - 1), 0, len(self.pathway) - 1)
-		j = clamp(x * (len(self.pathway) - 1) + 1, 0, len(self.pathway) - 1)
-		return lerp(self.pathway[int(j)], self.pathway[int(i)], math.floor(j) - i)
-
-	# fetch a tile
-	def peek(self, i, j):
-		if (i < 0 or i >= level_w or j < 0 or j >= level_h):
-			return TILE_WALL
-		# this array is 'flattened', this is the C-way of doing 2-dimensional
-		# arrays
-		return self.data[j * level_w + i]
-
-	# set a tile
-	def poke(self, i, j, tile):
-		if (not (i < 0 or i >= level_w or j < 0 or j >= level_h)):
-			self.data[j * level_w + i] = tile
-
-	# set a blood pixel
-	def set_blood(self, x, y, color):
-		global level_offset_x, level_offset_y
-		global game_level
-		# get the tile coordinates
-		tx = int((x - level_offset_x) / tile_w)
-		ty = int((y - level_offset_y) / tile_h)
-		# make sure it's in bounds
-		if (tx < 0 or ty < 0 or tx >= level_w or ty >= level_h):
-			return
-		# only set the pixel if it is on a floor tile
-		if (can_be_placed_on_floor(game_level.peek(tx, ty))):
-			s = 16
-			alpha = (color[0] / s, color[1] / s, color[2] / s, 8)
-			self.blood.fill(alpha, (int(x), int(y), 1, 1), pygame.BLEND_RGBA_ADD)
-
 # load enemies
 enemy_grunt = load_image('enemy_grunt.png')
 enemy_speedy = load_image('enemy_speedy.png')
 enemy_bulk = load_image('enemy_bulk.png')
 
-# all enemy types
-ENEMY_GRUNT = 0
-ENEMY_SPEEDY = 1
-ENEMY_BULK = 2
-
-# enemy speed multipliers. index by enemy type
-E_BASE_SPEED = 0.001
-E_SPEED = [1.0, 1.75, 0.6]
-# enemy damage multipliers. index by enemy type
-E_BASE_DAMAGE = 7.5
-E_DAMAGE = [1.0, 0.75, 3.0]
-# enemy health multipliers. index by enemy type
-E_BASE_HEALTH = 5.0
-E_HEALTH = [1.5, 1.25, 5.5]
-
-# enemy loot drops
-E_LOOT = [15, 20, 25]
-
 # enemy sprites. index by enemy type
 E_SPRITE = [enemy_grunt, enemy_speedy, enemy_bulk]
 
-# enemy colors. index by enemy type
-E_COLOR = [(255, 153, 35), (119, 179, 0), (0, 74, 179)]
-
-# an enemy
-class Enemy:
-	# create an enemy
-	def __init__(self, variation):
-		self.variation = variation
-		self.position = 0.0
-		self.speed = E_BASE_SPEED * E_SPEED[variation]
-		self.damage = E_BASE_DAMAGE * E_DAMAGE[variation]
-		self.health = E_BASE_HEALTH * E_HEALTH[variation]
-		self.max_health = E_BASE_HEALTH * E_HEALTH[variation]
-		self.id = random.randint(0x0, 0xDEADBEEF)
-
-	# tick the enemy
-	def tick(self):
-		self.position += self.speed
-
-		# periodically damage the gold if we're sitting on it
-		global iteration
-		if ((iteration + self.id) % 60 == 0):
-			global game_gold
-			global game_level
-			global level_offset_x, level_offset_y
-			global stat_damage
-			pos = self.pos()
-			px = level_offset_x + pos[0] * tile_w
-			py = level_offset_y + pos[1] * tile_h
-			aabbx = game_level.gold_x * tile_w + level_offset_x
-			aabby = game_level.gold_y * tile_h + level_offset_y
-			if (in_aabb_raw(px, py, aabbx, aabby, tile_w, tile_h)):
-				add_gold_explosion(px + signed_rand() * tile_w + 8.0, py + signed_rand() * tile_h + 8.0)
-				game_gold -= E_BASE_DAMAGE * E_DAMAGE[self.variation]
-				stat_damage += E_BASE_DAMAGE * E_DAMAGE[self.variation]
-				do_sound('gold_damage')
-
-	# get the position
-	def pos(self):
-		global game_level
-		return game_level.pos(self.position)
-
-	# get the position a little bit in the future
-	def next_pos(self):
-		global game_level
-		global BULLET_SPEED
-		# this prediction function is extremely accurate
-		return game_level.pos(self.position + self.speed * (1.0 / BULLET_SPEED))
-
-	# draw the enemy
-	def draw(self):
-		global game_level
-		global level_offset_x, level_offset_y
-		pos = self.pos()
-		px = level_offset_x + pos[0] * tile_w
-		py = level_offset_y + pos[1] * tile_h
-		draw_image(E_SPRITE[self.variation], px, py)
-		draw_progress_bar(px + 1, py + 16, 0.0, self.max_health, self.health)
-
-# all the enemies
-game_enemies = []
-
-# spawn an enemy
-def spawn_enemy(variation):
-	game_enemies.append(Enemy(variation))
-
-# all turret types
-TURRET_PISTOL = 0
-TURRET_SHOTGUN = 1
-TURRET_UZI = 2
-
-# turret cooldowns
-TURRET_COOLDOWN = [35, 85, 10]
-# turret accuracy (low is better)
-TURRET_ACCURACY = [0.0, 19.0, 4.0]
-# turret bullets per shot
-TURRET_BULLETS = [1, 10, 1]
-# turret damage modifiers
-TURRET_DAMAGE = [0.5, 0.35, 0.1]
-# turret ranges
-TURRET_RANGE = [80.0, 50.0, 100.0]
-
-# turret base damage
-TURRET_BASE_DAMAGE = 2.5
-
-# a turret
-class Turret:
-	# create a turret
-	def __init__(self, variation, x, y):
-		self.variation = variation
-		self.x = x
-		self.y = y
-		self.direction = 13.14
-
-	# tick the turret
-	def tick(self):
-		self.direction += 0.0123
-
-	# draw the turret (it's literally a line)
-	def draw(self):
-		global level_offset_x, level_offset_y
-		x0 = level_offset_x + self.x * tile_w + tile_w / 2 - 1
-		y0 = level_offset_y + self.y * tile_h + tile_h / 2 - 1
-		t_len = 10.0
-		x1 = x0 + math.sin(self.direction) * t_len
-		y1 = y0 + math.cos(self.direction) * t_len
-		pygame.draw.line(surface, (255, 255, 255), (x0, y0), (x1, y1), 2)
-
-# all the turrets
-game_turrets = []
-
-# add a turret
-def add_turret(variation, x, y):
-	game_turrets.append(Turret(variation, x, y))
-
-# all trap types
-TRAP_SPIKE = 0
-TRAP_BOMB = 1
-
-# a trap
-class Trap:
-	# create a trap
-	def __init__(self, variation, x, y):
-		self.variation = variation
-		self.x = x
-		self.y = y
-		# damage dealt, used by spike traps only
-		self.dealt = 0.0
-		self.dead = False
-
-# all the traps
-game_traps = []
-
-# add a trap
-def add_trap(variation, x, y):
-	game_traps.append(Trap(variation, x, y))
-
-# bullet constants
-BULLET_SPEED = 0.05
-BULLET_LENGTH = 10.0
-
-# a bullet. these bullets are completely fake. since the game is fast paced,
-# it suffices to draw a ray that zooms in on a target, but the target is
-# damaged even before the ray hits it. in gameplay, these 'fake' bullets are
-# unnoticeable
-class Bullet:
-	# create a bullet
-	def __init__(self, x0, y0, x1, y1):
-		self.x0 = x0
-		self.y0 = y0
-		self.x1 = x1
-		self.y1 = y1
-		self.t = 0.0
-		self.length = dist((x0, y0), (x1, y1))
-
-	# tick the bullet
-	def tick(self):
-		self.t += BULLET_SPEED
-
-	# draw the bullet
-	def draw(self):
-		tc0 = clamp(self.t, 0.0, 1.0)
-		tc1 = clamp(self.t + BULLET_LENGTH / self.length, 0.0, 1.0)
-		x0 = self.x0 + (self.x1 - self.x0) * tc0
-		y0 = self.y0 + (self.y1 - self.y0) * tc0
-		x1 = self.x0 + (self.x1 - self.x0) * tc1
-		y1 = self.y0 + (self.y1 - self.y0) * tc1
-		pygame.draw.line(surface, (255, 255, 255), (x0, y0), (x1, y1), random.randint(1, 3))
-
-# all the bullets
-game_bullets = []
-
-# add a bullet
-def add_bullet(x0, y0, x1, y1):
-	game_bullets.append(Bullet(x0, y0, x1, y1))
-
-# a particle
-class Particle:
-	# create a particle
-	def __init__(self, x, y, direction, color, power):
-		self.x = x
-		self.y = y
-		# self.sx and self.sy are tracer positions used for blood tracing
-		self.sx = x
-		self.sy = y
-		self.color = color
-		length = random.random() * power
-		self.dx = math.sin(direction) * length
-		self.dy = math.cos(direction) * length
-		self.life = random.randint(10, 50)
-
-	# tick the particle
-	def tick(self):
-		global level_offset_x, level_offset_y
-		global game_level
-		drag = 0.9
-		self.dx *= drag
-		self.dy *= drag
-		self.x += self.dx
-		self.y += self.dy
-		# don't move the tracer if it's in a wall
-		tx = int((self.sx - level_offset_x) / tile_w)
-		ty = int((self.sy - level_offset_y) / tile_h)
-		if (can_be_placed_on_floor(game_level.peek(tx, ty))):
-			self.sx += self.dx
-			self.sy += self.dy
-		self.life -= 1
-
-	# draw the particle
-	def draw(self):
-		pygame.draw.line(surface, self.color, (self.x, self.y), (self.x + self.dx, self.y + self.dy))
-
-# all the particles
-game_particles = []
-
-# add a particle
-def add_particle(x, y, direction, color=(255, 255, 255), power=5.0):
-	game_particles.append(Particle(x, y, direction, color, power))
-
-# add a random ambient particle
-def add_random_ambient_particle(color=(255, 255, 255), power=5.0):
-	game_particles.append(Particle(random.randint(0, window_w), random.randint(0, window_h), random.random() * 360.0, color, power))
-
-# add a particle burst
-def add_particle_burst(x, y, color=(255, 255, 255), power=5.0):
-	for i in range(0, 100):
-		game_particles.append(Particle(x, y, random.random() * 360.0, color, power))
-
-# add a tiny particle burst
-def add_tiny_particle_burst(x, y, color=(255, 255, 255), power=2.0):
-	for i in range(0, 10):
-		game_particles.append(Particle(x, y, random.random() * 360.0, color, power))
-
-# add an enemy explosion
-def add_enemy_explosion(x, y, color=(255, 255, 255), power=5.0):
-	for i in range(0, 300):
-		game_particles.append(Particle(x, y, random.random() * 360.0, color, power))
-
-# add an explosion
-def add_explosion(x, y):
-	global game_screenshake_x, game_screenshake_y
-	SHAKE_POWER = 100.0
-	game_screenshake_x = signed_rand() * SHAKE_POWER
-	game_screenshake_y = signed_rand() * SHAKE_POWER
-	for i in range(0, 500):
-		g = random.randint(0, 255)
-		color = (clamp(g * 10, 0, 255), clamp(g * 2, 0, 255), g)
-		game_particles.append(Particle(x, y, random.random() * 360.0, color, random.random() * 15.0))
-
-# add a gold explosion
-def add_gold_explosion(x, y):
-	global game_screenshake_x, game_screenshake_y
-	SHAKE_POWER = 25.0
-	game_screenshake_x = signed_rand() * SHAKE_POWER
-	game_screenshake_y = signed_rand() * SHAKE_POWER
-	for i in range(0, 250):
-		g = random.randint(0, 255)
-		color = (clamp(g * 5, 0, 255), clamp(g * 5, 0, 255), g)
-		game_particles.append(Particle(x, y, random.random() * 360.0, color, random.random() * 7.5))
+# draw an enemy of a type, with some health out of its maximum health, at a
+# pixel position
+def draw_enemy(variation, health, max_health, px, py):
+	draw_image(E_SPRITE[variation], px, py)
+	draw_progress_bar(px + 1, py + 16, 0.0, max_health, health)
+
+# draw a turret (it's literally a line)
+def draw_turret(turret):
+	x0 = level_offset_x - camera_x + turret.x * tile_w + tile_w / 2 - 1
+	y0 = level_offset_y - camera_y + turret.y * tile_h + tile_h / 2 - 1
+	t_len = 10.0
+	x1 = x0 + math.sin(turret.direction) * t_len
+	y1 = y0 + math.cos(turret.direction) * t_len
+	pygame.draw.line(surface, (255, 255, 255), (x0, y0), (x1, y1), 2)
+
+# draw all the bullets of a bullet pool. the ends of every bullet are worked
+# out at once
+def draw_bullets(bullets):
+	n = bullets.count
+	if (n == 0):
+		return
+	bx0 = bullets.x0[:n] - camera_x
+	by0 = bullets.y0[:n] - camera_y
+	bdx = bullets.x1[:n] - bullets.x0[:n]
+	bdy = bullets.y1[:n] - bullets.y0[:n]
+	t = bullets.t[:n]
+	tc0 = np.clip(t, 0.0, 1.0)
+	tc1 = np.clip(t + BULLET_LENGTH / np.hypot(bdx, bdy), 0.0, 1.0)
+	x0 = (bx0 + bdx * tc0).tolist()
+	y0 = (by0 + bdy * tc0).tolist()
+	x1 = (bx0 + bdx * tc1).tolist()
+	y1 = (by0 + bdy * tc1).tolist()
+	for i in range(0, n):
+		pygame.draw.line(surface, (255, 255, 255), (x0[i], y0[i]), (x1[i], y1[i]), random.randint(1, 3))
+
+# draw all the particles of a particle system. if (camera) is True, they are
+# drawn through the camera, and if the level scrolls, only the ones in view
+# are drawn
+def draw_particles(particles, camera=False):
+	n = particles.count
+	x = particles.x[:n]
+	y = particles.y[:n]
+	dx = particles.dx[:n]
+	dy = particles.dy[:n]
+	color = particles.color[:n]
+	if (camera):
+		x = x - camera_x
+		y = y - camera_y
+		if (level_scrolls(game.level)):
+			keep = in_view(x, y, 4)
+			x = x[keep]
+			y = y[keep]
+			dx = dx[keep]
+			dy = dy[keep]
+			color = color[keep]
+	x = x.tolist()
+	y = y.tolist()
+	dx = dx.tolist()
+	dy = dy.tolist()
+	color = color.tolist()
+	for i in range(0, len(x)):
+		pygame.draw.line(surface, color[i], (x[i], y[i]), (x[i] + dx[i], y[i] + dy[i]))
 
 # load the levels
-level1 = Level('level1.txt')
-level2 = Level('level2.txt')
-level3 = Level('level3.txt')
+level1 = load_level(1)
+level2 = load_level(2)
+level3 = load_level(3)
 levels = [level1, level2, level3]
 
-# render a level to the display
+# the camera, which is how many pixels the view is scrolled into the level.
+# it only moves on levels that are bigger than the view
+camera_x = 0
+camera_y = 0
+
+# how many pixels the camera scrolls per frame while an arrow key is held
+CAMERA_SPEED = 6
+
+# the part of the window that the level is shown in
+view_rect = pygame.Rect(int(level_offset_x), int(level_offset_y), level_w * tile_w, level_h * tile_h)
+
+# returns True if a level is bigger than the view, so that it has to scroll
+def level_scrolls(level):
+	return level.w > level_w or level.h > level_h
+
+# move the camera by (dx, dy) pixels, keeping the view inside the level
+def move_camera(dx, dy):
+	global camera_x
+	global camera_y
+	level = game.level
+	camera_x = int(clamp(camera_x + dx, 0, max(0, (level.w - level_w) * tile_w)))
+	camera_y = int(clamp(camera_y + dy, 0, max(0, (level.h - level_h) * tile_h)))
+
+# get a boolean array that is True for every pixel position in the arrays
+# (x, y) that is in the view, or within (margin) pixels of it
+def in_view(x, y, margin):
+	return (x >= view_rect.left - margin) & (x < view_rect.right + margin) & (y >= view_rect.top - margin) & (y < view_rect.bottom + margin)
+
+# get the chunks of a level that are in the view, as (ci, cj) pairs
+def visible_chunks(level):
+	cw = LEVEL_CHUNK * tile_w
+	ch = LEVEL_CHUNK * tile_h
+	i1 = min((camera_x + view_rect.w - 1) // cw, (level.w - 1) // LEVEL_CHUNK)
+	j1 = min((camera_y + view_rect.h - 1) // ch, (level.h - 1) // LEVEL_CHUNK)
+	return [(ci, cj) for cj in range(camera_y // ch, j1 + 1) for ci in range(camera_x // cw, i1 + 1)]
+
+# render the tile (i, j) of a level onto the pre-rendered copy of its chunk
+def draw_tile(background, level, i, j):
+	tx = (i % LEVEL_CHUNK) * tile_w
+	ty = (j % LEVEL_CHUNK) * tile_h
+	background.fill((0, 0, 0), (tx, ty, tile_w, tile_h))
+	tile = level.peek(i, j)
+	if (tile >= 0):
+		background.blit(tiles[tile].source, (tx, ty), tiles[tile].area)
+
+# render a level to the display, with its top left corner at (x, y). the
+# level keeps a pre-rendered copy of each chunk, which is rendered when the
+# chunk first comes into view. after that only the tiles that changed are
+# rendered again, so this is usually just one blit per chunk in view
 def draw_level(level, x, y):
-	for j in range(0, level_h):
-		for i in range(0, level_w):
-			tile = level.peek(i, j)
-			if (tile < 0):
-				continue
-			else:
-				offset_x = x + i * tile_w
-				offset_y = y + j * tile_h
-				draw_subimage(tiles[tile], offset_x, offset_y)
-
-# calculate the offset at which to draw any level
-level_offset_x = window_w / 2 - (level_w * tile_w) / 2
-level_offset_y = window_h / 2 - ((level_h - 3) * tile_h) / 2
+	for (i, j) in level.dirty:
+		background = level.backgrounds.get((i // LEVEL_CHUNK, j // LEVEL_CHUNK))
+		if (background is not None):
+			draw_tile(background, level, i, j)
+	level.dirty.clear()
+	for (ci, cj) in visible_chunks(level):
+		background = level.backgrounds.get((ci, cj))
+		if (background is None):
+			w = min(LEVEL_CHUNK, level.w - ci * LEVEL_CHUNK)
+			h = min(LEVEL_CHUNK, level.h - cj * LEVEL_CHUNK)
+			background = pygame.Surface((w * tile_w, h * tile_h))
+			for j in range(cj * LEVEL_CHUNK, cj * LEVEL_CHUNK + h):
+				for i in range(ci * LEVEL_CHUNK, ci * LEVEL_CHUNK + w):
+					draw_tile(background, level, i, j)
+			level.backgrounds[(ci, cj)] = background
+		surface.blit(background, (x + ci * LEVEL_CHUNK * tile_w, y + cj * LEVEL_CHUNK * tile_h))
+
+# draw the blood effects of a level, with its top left corner at (x, y). only
+# the chunks that are in view and bloody are drawn. the surfaces share their
+# pixels with the level's blood arrays, so they never have to be copied
+def draw_blood(level, x, y):
+	for key in visible_chunks(level):
+		blood = level.blood.get(key)
+		if (blood is None):
+			continue
+		blood_surface = level.blood_surfaces.get(key)
+		if (blood_surface is None):
+			blood_surface = pygame.image.frombuffer(blood, (LEVEL_CHUNK * tile_w, LEVEL_CHUNK * tile_h), 'RGBA')
+			level.blood_surfaces[key] = blood_surface
+		surface.blit(blood_surface, (x + key[0] * LEVEL_CHUNK * tile_w, y + key[1] * LEVEL_CHUNK * tile_h))
 
 # render a numeric string to the display
 def draw_numeric(string, x, y):
@@ -881,34 +504,167 @@ sound_names = [
 	'turret_uzi' # used
 ]
 
-# load all the sounds
-sounds = {}
-for i in range(0, len(sound_names)):
-	sounds[sound_names[i]] = load_sound('snd_' + sound_names[i] + '.wav')
-
-# play a sound
+# the sounds that the game never plays. they aren't loaded unless something
+# asks for them
+unused_sound_names = ['ambience', 'begin', 'text_beep']
+
+# the sounds. decoding them takes a while, so they are loaded in the
+# background while the title screen is already showing. a sound that is
+# needed before the background thread got to it is loaded right away instead
+class SoundBank:
+	# start loading the sounds with the given names in the background
+	def __init__(self, names):
+		self.sounds = {}
+		self.lock = threading.Lock()
+		self.thread = threading.Thread(target=self.load_all, args=(names,), daemon=True)
+		self.thread.start()
+
+	# load a sound, unless it's already loaded
+	def load(self, name):
+		with self.lock:
+			sound = self.sounds.get(name)
+			if (sound is None):
+				sound = load_sound('snd_' + name + '.wav')
+				self.sounds[name] = sound
+			return sound
+
+	# load some sounds one after the other. this runs in the background
+	def load_all(self, names):
+		for i in range(0, len(names)):
+			self.load(names[i])
+
+	# get a sound, loading it if it isn't loaded yet
+	def get(self, name):
+		sound = self.sounds.get(name)
+		if (sound is None):
+			sound = self.load(name)
+		return sound
+
+# start loading all the sounds that are used
+sounds = SoundBank([name for name in sound_names if name not in unused_sound_names])
+
+# the number of mixer channels, and how many of them are kept for the
+# important sounds
+SOUND_CHANNELS = 16
+SOUND_RESERVED_CHANNELS = 4
+
+# the most copies of the same sound that can play at once
+SOUND_VOICES = 3
+
+# the sounds that matter the most to the player. they can play on the
+# reserved channels, so that a wave of gunfire can't drown them out
+important_sound_names = ['failed_purchase', 'gold_damage', 'heal', 'level_fail', 'level_pass', 'menu_select', 'place_trap', 'place_turret', 'purchase']
+
+pygame.mixer.set_num_channels(SOUND_CHANNELS)
+pygame.mixer.set_reserved(SOUND_RESERVED_CHANNELS)
+
+# plays the sounds that were asked for during a frame, all at once at the end
+# of the frame. a sound that was asked for more than once in a frame is only
+# played once, a sound that is already playing (SOUND_VOICES) times isn't
+# played again, and if every channel is busy the sound is dropped instead of
+# cutting another one off
+class SoundDispatcher:
+	def __init__(self):
+		# the names of the sounds to play at the end of the frame, in order
+		self.queued = []
+		# the channels that each sound is playing on
+		self.playing = {}
+
+	# play a sound at the end of the frame
+	def queue(self, sound_name):
+		if (sound_name not in self.queued):
+			self.queued.append(sound_name)
+
+	# play all the sounds that were asked for during the frame
+	def flush(self):
+		for i in range(0, len(self.queued)):
+			self.play(self.queued[i])
+		self.queued.clear()
+
+	# play a sound right away, if it isn't playing too many times already and
+	# there is a channel for it
+	def play(self, sound_name):
+		sound = sounds.get(sound_name)
+		voices = [c for c in self.playing.get(sound_name, []) if c.get_busy() and c.get_sound() is sound]
+		self.playing[sound_name] = voices
+		if (len(voices) >= SOUND_VOICES):
+			return
+		channel = self.find_channel(sound_name in important_sound_names)
+		if (channel is None):
+			return
+		channel.play(sound)
+		voices.append(channel)
+
+	# find a free channel. important sounds try the reserved channels first
+	def find_channel(self, important):
+		if (important):
+			for i in range(0, SOUND_RESERVED_CHANNELS):
+				channel = pygame.mixer.Channel(i)
+				if (not channel.get_busy()):
+					return channel
+		return pygame.mixer.find_channel()
+
+sound_dispatcher = SoundDispatcher()
+
+# play a sound. it actually plays at the end of the frame, see
+# SoundDispatcher
 def do_sound(sound_name):
 	# doesn't seem to work on my computer
-	play_sound(sounds[sound_name])
-	pass
+	sound_dispatcher.queue(sound_name)
 
 # load the font
 pygame.font.init()
 font_default = pygame.font.Font('ProggyClean.ttf', 16)
 
+# the most pieces of rendered text and text sizes that are remembered
+TEXT_CACHE_SIZE = 256
+
+# the pieces of text that were rendered lately, keyed by (font, text, color,
+# inverted), and the sizes of the pieces of text that were measured lately,
+# keyed by (font, text). the menus draw the same text every frame, so it only
+# has to be rendered once. when there are too many, the ones that were used
+# the longest time ago are thrown away
+text_cache = collections.OrderedDict()
+text_size_cache = collections.OrderedDict()
+
+# get some rendered text from the cache, rendering it if it isn't there. the
+# text is converted to the format of the screen so that it can be blitted
+# quickly
+def get_rendered_text(font, text, color, inverted):
+	key = (font, text, tuple(color), inverted)
+	paste = text_cache.get(key)
+	if (paste is not None):
+		text_cache.move_to_end(key)
+		return paste
+	if (inverted):
+		paste = font.render(text, False, (0, 0, 0), color).convert()
+	else:
+		paste = font.render(text, False, color).convert()
+	text_cache[key] = paste
+	if (len(text_cache) > TEXT_CACHE_SIZE):
+		text_cache.popitem(last=False)
+	return paste
+
 # render some text
 def render_text(font, text, color, x, y):
-	paste = font.render(text, False, color)
-	surface.blit(paste, (x, y))
+	surface.blit(get_rendered_text(font, text, color, False), (x, y))
 
 # render some inverted text
 def render_inverted_text(font, text, color, x, y):
-	paste = font.render(text, False, (0, 0, 0), color)
-	surface.blit(paste, (x, y))
+	surface.blit(get_rendered_text(font, text, color, True), (x, y))
 
 # measure some text
 def measure_text(font, text):
-	return font.size(text)
+	key = (font, text)
+	size = text_size_cache.get(key)
+	if (size is not None):
+		text_size_cache.move_to_end(key)
+		return size
+	size = font.size(text)
+	text_size_cache[key] = size
+	if (len(text_size_cache) > TEXT_CACHE_SIZE):
+		text_size_cache.popitem(last=False)
+	return size
 
 # render some horizontally centered text
 def render_horizontal_text(font, text, color, y):
@@ -925,72 +681,30 @@ def render_picked_horizontal_text(font, text, color, y):
 # create a clock for frame rate capping
 clock = pygame.time.Clock()
 
-# the state machine for the shops
-currently_placing_turret = False
-currently_placing_turret_type = -1
-
-# the game state
-game_level = level3
-game_level_num = 3
-game_gold = 100
-game_time = 0
-game_cash = 150
-game_time_started = seconds()
-game_health_cooldown = 0
-game_screenshake_x = 0.0
-game_screenshake_y = 0.0
-game_spawn = 0
-
-# the game statistics
-stat_kills = 0
-stat_turrets = 0
-stat_traps = 0
-stat_money = 0
-stat_damage = 0
+# the most simulation steps that can happen in one frame. if the computer is
+# so slow that even this many steps can't keep up, the game slows down a bit
+# instead of falling further and further behind
+MAX_TICKS_PER_FRAME = 8
+
+# the game state. the title screens use its particles and level too
+game = Engine(level3, 3)
+
+# the frame profiler. the engine times the phases of each step with it too.
+# F3 shows it and F4 saves it
+profiler = Profiler()
+game.profiler = profiler
+show_profiler = False
+profiler_stats = {}
 
 # initialize a level
 def init_level(x):
-	global game_level
-	global game_level_num
-	global game_gold
-	global game_time
-	global game_cash
-	global game_time_started
-	global game_health_cooldown
-	global game_screenshake_x
-	global game_screenshake_y
-	global game_spawn
-	global game_enemies
-	global game_bullets
-	global game_turrets
-	global game_traps
-	global game_particles
-	global stat_kills
-	global stat_turrets
-	global stat_traps
-	global stat_money
-	global stat_damage
-	game_level = levels[x - 1]
-	game_level_num = x
-	game_gold = 100
-	game_time = 0
-	game_cash = 150
-	game_time_started = seconds()
-	game_health_cooldown = 0
-	game_screenshake_x = 0.0
-	game_screenshake_y = 0.0
-	game_spawn = 0
-	game_enemies = []
-	game_bullets = []
-	game_turrets = []
-	game_traps = []
-	game_particles = []
-	stat_kills = 0
-	stat_turrets = 0
-	stat_traps = 0
-	stat_money = 0
-	stat_damage = 0
-	game_level.reset()
+	global camera_x
+	global camera_y
+	game.init_level(levels[x - 1], x, args.seed)
+	# start with the gold in the middle of the view, or as close as it gets
+	camera_x = 0
+	camera_y = 0
+	move_camera(game.level.gold_x * tile_w - view_rect.w // 2, game.level.gold_y * tile_h - view_rect.h // 2)
 
 # the title/you win/you lose animations
 game_title_tiles = []
@@ -1050,31 +764,266 @@ how_to_play = [
 # the current screen
 current_screen = SCREEN_TITLE
 
-# purchase an item for x dollars if there is at least that much cash
-# available. return True if the item was purchased
-def purchase_if_possible(x):
-	global game_cash
-	global stat_money
-	if (game_cash >= x):
-		game_cash -= x
-		stat_money += x
-		do_sound('purchase')
-		return True
-	do_sound('failed_purchase')
-	return False
+# the particle budget of each screen (see ParticleSystem.update_lod()). the
+# title, win and lose screens only have ambient explosions to show, so they
+# get by with a lot fewer particles than the game
+PARTICLE_BUDGETS = {
+	SCREEN_TITLE: 4000,
+	SCREEN_GAME: 12000,
+	SCREEN_THANKS: 4000,
+	SCREEN_HOW: 4000,
+	SCREEN_WIN: 4000,
+	SCREEN_LOSE: 4000
+}
+
+# the time that has passed but hasn't been simulated yet
+game_accumulator = 0.0
+
+# play the sounds that the game wants to play
+def play_game_sounds():
+	for i in range(0, len(game.sounds)):
+		do_sound(game.sounds[i])
+	game.sounds.clear()
+
+# tick the particles, draw them and trace their blood, then remove the dead
+# ones. this is for the screens that aren't simulated by the engine
+def update_particles():
+	game.particles.tick(game.level)
+	draw_particles(game.particles)
+	game.particles.bleed(game.level)
+	game.particles.compact()
+
+# do one step of the game simulation, and go to the win or lose screen if the
+# game is over
+def tick_game():
+	global current_screen
+	global game_title_iteration
+
+	game.step()
+	play_game_sounds()
+	profiler.lap('sound')
+
+	# go to the lose screen if we lost
+	if (game.state == STATE_LOST):
+		game_you_lose_tiles.clear()
+		game_title_iteration = 0
+		current_screen = SCREEN_LOSE
+
+	# go to the win screen if we won
+	if (game.state == STATE_WON):
+		game_you_win_tiles.clear()
+		game_title_iteration = 0
+		current_screen = SCREEN_WIN
+		# unlock following levels, if any
+		preferences['levels_unlocked'] = max(preferences['levels_unlocked'], game.level_num + 1)
+		# set highscore
+		preferences['highscores'][game.level_num - 1] = max(preferences['highscores'][game.level_num - 1], game.gold)
+
+	# save the replay of the game
+	if (game.state != STATE_PLAYING):
+		save_replay()
+
+# save the replay of the game, if we were asked to. this is done when the game
+# is won or lost, and when the player leaves a game that is still going, so
+# that the games that were given up on can be played again too
+def save_replay():
+	if (args.record is None):
+		return
+	if (game.state == STATE_PLAYING):
+		game.replay.record(game.ticks, ACTION_QUIT)
+	game.replay.save(args.record)
+
+# draw the game. (alpha) is how far the game is between the last simulation
+# step and the next one, which is used to smooth out the enemies' movement
+def draw_game(alpha):
+	# clear the screen
+	surface.fill((0, 0, 0))
+
+	# everything in the level is drawn through the camera. if the level
+	# scrolls, nothing is drawn outside of the view, and only what is in
+	# view is drawn at all
+	scrolls = level_scrolls(game.level)
+	if (scrolls):
+		surface.set_clip(view_rect)
+	x = level_offset_x - camera_x
+	y = level_offset_y - camera_y
+
+	# draw the level
+	draw_level(game.level, x, y)
+	profiler.lap('draw.level')
+
+	# draw the blood effects
+	draw_blood(game.level, x, y)
+	profiler.lap('draw.blood')
+
+	# draw the enemies somewhere between their last and current positions
+	enemies = game.enemies
+	n = enemies.count
+	last_position = enemies.last_position[:n]
+	progress = last_position + (enemies.position[:n] - last_position) * alpha
+	path_x, path_y = game.level.positions(progress, enemies.route[:n])
+	enemy_x = path_x * tile_w + x
+	enemy_y = path_y * tile_h + y
+	if (scrolls):
+		shown = np.flatnonzero(in_view(enemy_x, enemy_y, tile_w))
+	else:
+		shown = range(0, n)
+	enemy_x = enemy_x.tolist()
+	enemy_y = enemy_y.tolist()
+	variation = enemies.variation[:n].tolist()
+	health = enemies.health[:n].tolist()
+	max_health = enemies.max_health[:n].tolist()
+	for i in shown:
+		draw_enemy(variation[i], health[i], max_health[i], enemy_x[i], enemy_y[i])
+	profiler.lap('draw.enemies')
+
+	# draw the turrets
+	tx0 = camera_x // tile_w - 1
+	ty0 = camera_y // tile_h - 1
+	for i in range(0, len(game.turrets)):
+		turret = game.turrets[i]
+		if (not scrolls or (turret.x >= tx0 and turret.x <= tx0 + level_w + 1 and turret.y >= ty0 and turret.y <= ty0 + level_h + 1)):
+			draw_turret(turret)
+	profiler.lap('draw.turrets')
+
+	# draw the bullets
+	draw_bullets(game.bullets)
+	profiler.lap('draw.bullets')
+
+	# draw the particles
+	draw_particles(game.particles, True)
+	surface.set_clip(None)
+	profiler.lap('draw.particles')
+
+# do the shops and the placing of turrets and traps, then draw the heads-up
+# display
+def do_shop():
+	# draw the gun shop
+	wants_pistol_turret = draw_button(btn_pistol_turret, level_offset_x - 32, level_offset_y - tile_h * 3)
+	wants_shotgun_turret = draw_button(btn_shotgun_turret, level_offset_x - 32, level_offset_y - tile_h * 2)
+	wants_uzi_turret = draw_button(btn_uzi_turret, level_offset_x - 32, level_offset_y - tile_h * 1)
+	draw_image(gui_pricing, level_offset_x + tile_w * 6 - 32, level_offset_y - tile_h * 3)
+
+	# draw the misc. shop
+	if (game.health_cooldown == 0):
+		wants_health_up = draw_button(btn_health_up, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 3)
+	else:
+		wants_health_up = draw_disabled_button(btn_health_up, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 3)
+	wants_spike_trap = draw_button(btn_spike_trap, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 2)
+	wants_bomb_trap = draw_button(btn_bomb_trap, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 1)
+	draw_image(gui_pricing2, level_offset_x + tile_w * 12 + 32, level_offset_y - tile_h * 3)
+
+	# allow interaction with the shop. the engine makes sure that nothing
+	# can be bought if something is already in the player's 'hand'
+	if wants_pistol_turret:
+		game.buy(TILE_PISTOL_TURRET)
+	elif wants_shotgun_turret:
+		game.buy(TILE_SHOTGUN_TURRET)
+	elif wants_uzi_turret:
+		game.buy(TILE_UZI_TURRET)
+	elif wants_health_up:
+		game.buy_health_up()
+	elif wants_spike_trap:
+		game.buy(TILE_SPIKE_TRAP)
+	elif wants_bomb_trap:
+		game.buy(TILE_BOMB_TRAP)
+
+	# draw the interaction 'silhouette' so that the player can see where they
+	# are placing something
+	if (game.currently_placing_turret):
+		# get tile coordinates at mouse position, in the view and in the
+		# level
+		vx = int((mouse[0] - level_offset_x) / tile_w)
+		vy = int((mouse[1] - level_offset_y) / tile_h)
+		tx = int((mouse[0] - level_offset_x + camera_x) / tile_w)
+		ty = int((mouse[1] - level_offset_y + camera_y) / tile_h)
+		if (not (vx < 0 or vx >= level_w or vy < 0 or vy >= level_h)):
+			# not out of bounds, proceed
+			if (game.can_place(tx, ty)):
+				draw_subimage(tiles[game.currently_placing_turret_type], mouse[0], mouse[1])
+				# place the turret/trap if clicked. a cheat, right click to
+				# place as many as you want
+				if (mouse_left_pressed or mouse_right_pressed):
+					game.place(tx, ty, mouse_right_pressed)
+			else:
+				draw_subimage(tiles[TILE_NOPE], mouse[0], mouse[1])
+	profiler.lap('shop')
+
+	# draw the heads-up display
+	draw_image(gui_heads_up, level_offset_x + tile_w * 7, level_offset_y - tile_h * 3)
+	draw_numeric(format_int(game.gold, 3), level_offset_x + tile_w * 9, level_offset_y - tile_h * 3)
+	draw_numeric(format_int(game.time, 3), level_offset_x + tile_w * 9, level_offset_y - tile_h * 2)
+	draw_numeric(format_int(game.cash, 3), level_offset_x + tile_w * 9, level_offset_y - tile_h * 1)
+	profiler.lap('hud')
+
+# draw the profiler's statistics over everything else. the phases that take
+# the longest are at the top, and the numbers are milliseconds per frame. the
+# statistics are only worked out every few frames, since that isn't free
+def draw_profiler():
+	global profiler_stats
+	if (iteration % 15 == 0 or len(profiler_stats) == 0):
+		profiler_stats = profiler.stats()
+	stats = profiler_stats
+	if (len(stats) == 0):
+		return
+	frame = stats['frame']
+	color = (255, 255, 255)
+	if (frame['p95'] > FRAME_BUDGET):
+		color = (255, 64, 64)
+	render_inverted_text(font_default, '%-14s %5s %5s %5s' % ('ms/frame', 'p50', 'p95', 'p99'), (255, 255, 255), 4, 4)
+	y = 16
+	render_inverted_text(font_default, '%-14s %5.2f %5.2f %5.2f' % ('frame', frame['p50'], frame['p95'], frame['p99']), color, 4, y)
+	names = sorted([name for name in stats if name != 'frame'], key=lambda name: -stats[name]['p95'])
+	for name in names:
+		y += 12
+		phase = stats[name]
+		render_inverted_text(font_default, '%-14s %5.2f %5.2f %5.2f' % (name, phase['p50'], phase['p95'], phase['p99']), (255, 255, 255), 4, y)
+
+# copy the surface to the screen, moved by (shake_x, shake_y) screen pixels.
+# the surface is scaled straight onto the screen instead of onto a new surface
+# every frame, and then the screen is scrolled by the screenshake, so only the
+# strips that the scrolling uncovered have to be cleared
+def present(shake_x, shake_y):
+	w, h = screen.get_size()
+	if (surface is not screen):
+		pygame.transform.scale(surface, (w, h), screen)
+	if (shake_x == 0 and shake_y == 0):
+		return
+	screen.scroll(shake_x, shake_y)
+	if (shake_x > 0):
+		screen.fill((0, 0, 0), (0, 0, shake_x, h))
+	elif (shake_x < 0):
+		screen.fill((0, 0, 0), (w + shake_x, 0, -shake_x, h))
+	if (shake_y > 0):
+		screen.fill((0, 0, 0), (0, 0, w, shake_y))
+	elif (shake_y < 0):
+		screen.fill((0, 0, 0), (0, h + shake_y, w, -shake_y))
 
 # game loop
 iteration = 0
+last_frame = seconds_float()
 quit = False
 while not quit:
 	# for timing
-	ms0 = ms()
+	profiler.begin_frame()
+
+	# measure how much time passed since the last frame
+	now = seconds_float()
+	frame_time = min(now - last_frame, MAX_TICKS_PER_FRAME * TICK_TIME)
+	last_frame = now
 
 	# poll events
 	for event in pygame.event.get():
 		if event.type == pygame.QUIT:
 			# quit
 			quit = True
+		elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+			# show or hide the profiler
+			show_profiler = not show_profiler
+		elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+			# save the profiler's statistics
+			profiler.dump(args.profile)
+			print('saved the frame profile to', args.profile)
 		elif event.type == pygame.KEYDOWN:
 			if (current_screen == SCREEN_THANKS or current_screen == SCREEN_HOW or current_screen == SCREEN_WIN or current_screen == SCREEN_LOSE):
 				game_title_iteration = len(title_tiles)
@@ -1085,9 +1034,10 @@ while not quit:
 
 	# update state
 	mouse_unscaled = pygame.mouse.get_pos()
-	mouse = (mouse_unscaled[0] / gfx_scale, mouse_unscaled[1] / gfx_scale)
+	mouse = (mouse_unscaled[0] / screen_scale, mouse_unscaled[1] / screen_scale)
 	mouse_left_pressed = pygame.mouse.get_pressed()[0]
 	mouse_right_pressed = pygame.mouse.get_pressed()[2]
+	profiler.lap('events')
 
 	# do whatever the current screen needs to do
 	if (current_screen == SCREEN_TITLE):
@@ -1099,7 +1049,7 @@ while not quit:
 			tile = title_tiles[len(game_title_tiles)]
 			tx = tile[0]
 			ty = tile[1]
-			add_tiny_particle_burst(title_offset_x + tx * 6, title_offset_y + ty * 6)
+			game.add_tiny_particle_burst(title_offset_x + tx * 6, title_offset_y + ty * 6)
 			game_title_tiles.append(tile)
 
 		# draw all the title tiles
@@ -1165,19 +1115,12 @@ while not quit:
 				render_horizontal_text(font_default, text, (255, 255, 255), y)
 
 		# add ambient explosions
-		if (game_title_iteration > len(title_tiles) and random.randint(0, 25) == 0):
+		if (game_title_iteration > len(title_tiles) and game.effects.randint(0, 25) == 0):
 			a = 10
-			add_explosion(random.randint(-a, window_w + a - 1), random.randint(-a, window_h + a - 1))
-
-		# draw the particles
-		for i in range(0, len(game_particles)):
-			p = game_particles[i]
-			p.tick()
-			p.draw()
-			game_level.set_blood(p.sx, p.sy, p.color)
+			game.add_explosion(game.effects.randint(-a, window_w + a - 1), game.effects.randint(-a, window_h + a - 1))
 
-		# remove dead particles
-		game_particles = [i for i in game_particles if i.life >= 0]
+		# tick and draw the particles, then remove the dead ones
+		update_particles()
 
 		# increment the iteration counter
 		game_title_iteration += 1
@@ -1212,7 +1155,7 @@ while not quit:
 			tile = you_win_tiles[len(game_you_win_tiles)]
 			tx = tile[0]
 			ty = tile[1]
-			add_tiny_particle_burst(title_offset_x + tx * 6, center_title_offset_y + ty * 6)
+			game.add_tiny_particle_burst(title_offset_x + tx * 6, center_title_offset_y + ty * 6)
 			game_you_win_tiles.append(tile)
 
 		# draw all the title tiles
@@ -1224,11 +1167,11 @@ while not quit:
 
 		# draw summary
 		summary = [
-			'You killed ' + str(stat_kills) + ' enemies',
-			'You deployed ' + str(stat_turrets) + ' turrets',
-			'You placed ' + str(stat_traps) + ' traps',
-			'You spent ' + str(stat_money) + ' dollars',
-			'You took ' + str(stat_damage) + ' damage',
+			'You killed ' + str(game.stat_kills) + ' enemies',
+			'You deployed ' + str(game.stat_turrets) + ' turrets',
+			'You placed ' + str(game.stat_traps) + ' traps',
+			'You spent ' + str(game.stat_money) + ' dollars',
+			'You took ' + str(game.stat_damage) + ' damage',
 			'',
 			'Press any key to continue'
 		]
@@ -1237,19 +1180,12 @@ while not quit:
 			render_horizontal_text(font_default, portion_of_text(summary[i], (game_title_iteration - i * 15) / 15), (255, 255, 255), y)
 
 		# add ambient explosions
-		if (game_title_iteration > len(you_win_tiles) and random.randint(0, 25) == 0):
+		if (game_title_iteration > len(you_win_tiles) and game.effects.randint(0, 25) == 0):
 			a = 10
-			add_explosion(random.randint(-a, window_w + a - 1), random.randint(-a, window_h + a - 1))
+			game.add_explosion(game.effects.randint(-a, window_w + a - 1), game.effects.randint(-a, window_h + a - 1))
 
-		# draw the particles
-		for i in range(0, len(game_particles)):
-			p = game_particles[i]
-			p.tick()
-			p.draw()
-			game_level.set_blood(p.sx, p.sy, p.color)
-
-		# remove dead particles
-		game_particles = [i for i in game_particles if i.life >= 0]
+		# tick and draw the particles, then remove the dead ones
+		update_particles()
 
 		# increment the iteration counter
 		game_title_iteration += 1
@@ -1262,7 +1198,7 @@ while not quit:
 			tile = you_lose_tiles[len(game_you_lose_tiles)]
 			tx = tile[0]
 			ty = tile[1]
-			add_tiny_particle_burst(title_offset_x + tx * 6, center_title_offset_y + ty * 6)
+			game.add_tiny_particle_burst(title_offset_x + tx * 6, center_title_offset_y + ty * 6)
 			game_you_lose_tiles.append(tile)
 
 		# draw all the title tiles
@@ -1274,11 +1210,11 @@ while not quit:
 
 		# draw summary
 		summary = [
-			'You killed ' + str(stat_kills) + ' enemies',
-			'You deployed ' + str(stat_turrets) + ' turrets',
-			'You placed ' + str(stat_traps) + ' traps',
-			'You spent ' + str(stat_money) + ' dollars',
-			'You took ' + str(stat_damage) + ' damage',
+			'You killed ' + str(game.stat_kills) + ' enemies',
+			'You deployed ' + str(game.stat_turrets) + ' turrets',
+			'You placed ' + str(game.stat_traps) + ' traps',
+			'You spent ' + str(game.stat_money) + ' dollars',
+			'You took ' + str(game.stat_damage) + ' damage',
 			'',
 			'Press any key to continue'
 		]
@@ -1287,304 +1223,70 @@ while not quit:
 			render_horizontal_text(font_default, portion_of_text(summary[i], (game_title_iteration - i * 15) / 15), (255, 255, 255), y)
 
 		# add ambient explosions
-		if (game_title_iteration > len(you_win_tiles) and random.randint(0, 25) == 0):
+		if (game_title_iteration > len(you_win_tiles) and game.effects.randint(0, 25) == 0):
 			a = 10
-			add_explosion(random.randint(-a, window_w + a - 1), random.randint(-a, window_h + a - 1))
-
-		# draw the particles
-		for i in range(0, len(game_particles)):
-			p = game_particles[i]
-			p.tick()
-			p.draw()
-			game_level.set_blood(p.sx, p.sy, p.color)
+			game.add_explosion(game.effects.randint(-a, window_w + a - 1), game.effects.randint(-a, window_h + a - 1))
 
-		# remove dead particles
-		game_particles = [i for i in game_particles if i.life >= 0]
+		# tick and draw the particles, then remove the dead ones
+		update_particles()
 
 		# increment the iteration counter
 		game_title_iteration += 1
 	elif (current_screen == SCREEN_GAME):
-		# go to the lose screen if we lost
-		if (game_gold < 0):
-			game_you_lose_tiles.clear()
-			game_title_iteration = 0
-			current_screen = SCREEN_LOSE
-			do_sound('level_fail')
-   
-		# get the elapsed time
-		game_time = seconds() - game_time_started
-   
-		# go to the win screen if we won
-		if (game_time >= 100):
-			game_you_win_tiles.clear()
-			game_title_iteration = 0
-			current_screen = SCREEN_WIN
-			do_sound('level_pass')
-			# unlock following levels, if any
-			preferences['levels_unlocked'] = max(preferences['levels_unlocked'], game_level_num + 1)
-			# set highscore
-			preferences['highscores'][game_level_num - 1] = max(preferences['highscores'][game_level_num - 1], game_gold)
-
-		# clear the screen
-		surface.fill((0, 0, 0))
-
-		# draw the level
-		draw_level(game_level, level_offset_x, level_offset_y)
-
-		# draw the blood effects
-		surface.blit(game_level.blood, (0, 0))
-
-		# draw the enemies
-		for i in range(0, len(game_enemies)):
-			e = game_enemies[i]
-			e.tick()
-			e.draw()
-			if (e.health <= 0):
-				# if the enemy died, do an explosion and give the player some
-				# money
-				pos = e.pos()
-				add_enemy_explosion(pos[0] * tile_w + level_offset_x + 8, pos[1] * tile_h + level_offset_y + 8, E_COLOR[e.variation])
-				game_cash += E_LOOT[e.variation]
-				do_sound('enemy_die')
-				stat_kills += 1
-
-		# remove dead enemies
-		game_enemies = [i for i in game_enemies if i.health > 0.0]
-
-		# draw the turrets
-		for i in range(0, len(game_turrets)):
-			game_turrets[i].tick()
-			game_turrets[i].draw()
-
-		# draw the bullets
-		for i in range(0, len(game_bullets)):
-			game_bullets[i].tick()
-			game_bullets[i].draw()
-
-		# remove dead bullets
-		game_bullets = [i for i in game_bullets if i.t < 1.0]
-
-		# get the positions of each enemy
-		enemy_positions = []
-		for i in range(0, len(game_enemies)):
-			pos = game_enemies[i].pos()
-			x = pos[0] * tile_w + level_offset_x + 8
-			y = pos[1] * tile_h + level_offset_y + 8
-			enemy_positions.append((x, y))
-
-		# do turret AI
-		for i in range(0, len(game_turrets)):
-			turret = game_turrets[i]
-			tv = turret.variation
-			if (len(enemy_positions) > 0):
-				tx = turret.x * tile_w + level_offset_x + 8
-				ty = turret.y * tile_h + level_offset_y + 8
-				t = (tx, ty)
-				# find the index of the nearest enemy
-				e = nearest_to(t, enemy_positions)
-				# find the distance to the nearest enemy's future position
-				prediction = game_enemies[e].next_pos()
-				u = prediction[0] * tile_w + level_offset_x + 8
-				v = prediction[1] * tile_h + level_offset_y + 8
-				p = (u, v)
-				d = dist(t, p)
-				# point towards that enemy
-				turret.direction = angle_to(t, p)
-				# check if the enemy is in range
-				if (d < TURRET_RANGE[tv]):
-					# check if the turret can shoot. this is basically checking
-					# if the iteration number plus a scrambled offset is a
-					# multiple of (cooldown), which makes the turret shoot every
-					# (cooldown) iterations
-					cooldown = TURRET_COOLDOWN[tv]
-					if ((iteration + i * 1337) % cooldown == 0):
-						# shoot as many bullets as required
-						for z in range(0, TURRET_BULLETS[tv]):
-							# shoot a bullet and weaken the enemy
-							add_bullet(t[0], t[1], p[0] + signed_rand() * TURRET_ACCURACY[tv], p[1] + signed_rand() * TURRET_ACCURACY[tv])
-							game_enemies[e].health -= TURRET_BASE_DAMAGE * TURRET_DAMAGE[tv]
-						# play the correct sound
-						if (tv == TURRET_PISTOL):
-							do_sound('turret_pistol')
-						elif (tv == TURRET_SHOTGUN):
-							do_sound('turret_shotgun')
-						elif (tv == TURRET_UZI):
-							do_sound('turret_uzi')
-
-		# do trap AI
-		for i in range(0, len(game_traps)):
-			trap = game_traps[i]
-			aabbx = trap.x * tile_w + level_offset_x
-			aabby = trap.y * tile_h + level_offset_y
-			for j in range(0, len(game_enemies)):
-				enemy = game_enemies[j]
-				pos = enemy.pos()
-				px = pos[0] * tile_w + level_offset_x + 8
-				py = pos[1] * tile_h + level_offset_y + 8
-				if (in_aabb_raw(px, py, aabbx, aabby, tile_w, tile_h)):
-					# activate the trap
-					if (trap.variation == TRAP_SPIKE):
-						# deal out some damage
-						enemy.health -= 1.0
-						trap.dealt += 1.0
-						# if the trap dealt enough damage, kill it
-						if (trap.dealt > 10.0):
-							add_particle_burst(px, py)
-							trap.dead = True
-						do_sound('enemy_hit')
-					elif (trap.variation == TRAP_BOMB):
-						# cause an explosion and obliterate the enemy
-						add_explosion(px, py)
-						enemy.health -= 9999.0
-						trap.dead = True
-			# if the trap was killed then remove it from the map
-			if (trap.dead):
-				game_level.poke(trap.x, trap.y, TILE_FLOOR)
-
-		# remove dead traps
-		game_traps = [i for i in game_traps if i.dead == False]
-
-		# draw the particles
-		for i in range(0, len(game_particles)):
-			p = game_particles[i]
-			p.tick()
-			p.draw()
-			game_level.set_blood(p.sx, p.sy, p.color)
-
-		# remove dead particles
-		game_particles = [i for i in game_particles if i.life >= 0]
-
-		# draw the gun shop
-		wants_pistol_turret = draw_button(btn_pistol_turret, level_offset_x - 32, level_offset_y - tile_h * 3)
-		wants_shotgun_turret = draw_button(btn_shotgun_turret, level_offset_x - 32, level_offset_y - tile_h * 2)
-		wants_uzi_turret = draw_button(btn_uzi_turret, level_offset_x - 32, level_offset_y - tile_h * 1)
-		draw_image(gui_pricing, level_offset_x + tile_w * 6 - 32, level_offset_y - tile_h * 3)
-
-		# draw the misc. shop
-		if (game_health_cooldown == 0):
-			wants_health_up = draw_button(btn_health_up, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 3)
-			if (wants_health_up):
-				do_sound('heal')
-		else:
-			wants_health_up = draw_disabled_button(btn_health_up, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 3)
-		wants_spike_trap = draw_button(btn_spike_trap, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 2)
-		wants_bomb_trap = draw_button(btn_bomb_trap, level_offset_x + tile_w * 14 + 32, level_offset_y - tile_h * 1)
-		draw_image(gui_pricing2, level_offset_x + tile_w * 12 + 32, level_offset_y - tile_h * 3)
-
-		# allow interaction with the shop if something is not already in the
-		# player's 'hand'
-		if (not currently_placing_turret):
-			if wants_pistol_turret:
-				if (purchase_if_possible(50)):
-					currently_placing_turret = True
-					currently_placing_turret_type = TILE_PISTOL_TURRET
-			elif wants_shotgun_turret:
-				if (purchase_if_possible(100)):
-					currently_placing_turret = True
-					currently_placing_turret_type = TILE_SHOTGUN_TURRET
-			elif wants_uzi_turret:
-				if (purchase_if_possible(150)):
-					currently_placing_turret = True
-					currently_placing_turret_type = TILE_UZI_TURRET
-			elif wants_health_up:
-				if (game_health_cooldown == 0 and purchase_if_possible(50)):
-					game_gold += 15
-					if (game_gold > 100):
-						game_gold = 100
-					# set the health cooldown so that you can't use a ton of
-					# health-ups in a row
-					game_health_cooldown = 600
-			elif wants_spike_trap:
-				if (purchase_if_possible(100)):
-					currently_placing_turret = True
-					currently_placing_turret_type = TILE_SPIKE_TRAP
-			elif wants_bomb_trap:
-				if (purchase_if_possible(150)):
-					currently_placing_turret = True
-					currently_placing_turret_type = TILE_BOMB_TRAP
-
-		# lower the health cooldown
-		if (game_health_cooldown > 0):
-			game_health_cooldown -= 1
-
-		# draw the interaction 'silhouette' so that the player can see where they
-		# are placing something
-		if (currently_placing_turret):
-			# get tile coordinates at mouse position
-			tx = int((mouse[0] - level_offset_x) / tile_w)
-			ty = int((mouse[1] - level_offset_y) / tile_h)
-			if (not (tx < 0 or tx >= level_w or ty < 0 or ty >= level_h)):
-				# not out of bounds, proceed
-				tile = game_level.peek(tx, ty)
-				if (can_be_placed_on_wall(currently_placing_turret_type)):
-					# make sure the hovered tile is a wall tile
-					if (tile == TILE_WALL):
-						draw_subimage(tiles[currently_placing_turret_type], mouse[0], mouse[1])
-						# place the turret/trap if clicked
-						if (mouse_left_pressed or mouse_right_pressed):
-							do_sound('place_turret')
-							stat_turrets += 1
-							add_particle_burst(mouse[0], mouse[1])
-							# note that the turret type enumerations are
-							# sequential, so doing this is kind of hacky but still
-							# valid
-							add_turret(currently_placing_turret_type - TILE_PISTOL_TURRET, tx, ty)
-							game_level.poke(tx, ty, currently_placing_turret_type)
-							# a cheat, right click to place as many as you want
-							if (not mouse_right_pressed):
-								currently_placing_turret = False
-					else:
-						draw_subimage(tiles[TILE_NOPE], mouse[0], mouse[1])
-				elif (can_be_placed_on_floor(currently_placing_turret_type)):
-					# make sure the hovered tile is a floor tile
-					if (tile == TILE_FLOOR):
-						draw_subimage(tiles[currently_placing_turret_type], mouse[0], mouse[1])
-						# place the turret/trap if clicked
-						if (mouse_left_pressed or mouse_right_pressed):
-							do_sound('place_trap')
-							stat_traps += 1
-							add_particle_burst(mouse[0], mouse[1])
-							# note that the trap type enumerations are sequential,
-							# so doing this is kind of hacky but still valid
-							add_trap(currently_placing_turret_type - TILE_SPIKE_TRAP, tx, ty)
-							game_level.poke(tx, ty, currently_placing_turret_type)
-							# a cheat, right click to place as many as you want
-							if (not mouse_right_pressed):
-								currently_placing_turret = False
-					else:
-						draw_subimage(tiles[TILE_NOPE], mouse[0], mouse[1])
-
-		# draw the heads-up display
-		draw_image(gui_heads_up, level_offset_x + tile_w * 7, level_offset_y - tile_h * 3)
-		draw_numeric(format_int(game_gold, 3), level_offset_x + tile_w * 9, level_offset_y - tile_h * 3)
-		draw_numeric(format_int(game_time, 3), level_offset_x + tile_w * 9, level_offset_y - tile_h * 2)
-		draw_numeric(format_int(game_cash, 3), level_offset_x + tile_w * 9, level_offset_y - tile_h * 1)
-
-		# do spawning
-		spawner = [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2, 1, 2, 1, 2, 1, 2, 1, 2, 0, 0, 0, 0, 2, 2, 2, 2, 1, 1, 1, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1]
-		if ((iteration - 1) % 50 == 0):
-			game_spawn += 1
-			spawn_enemy(spawner[(game_spawn - 1) % len(spawner)])
+		# scroll the camera with the arrow keys
+		keys = pygame.key.get_pressed()
+		move_camera((keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * CAMERA_SPEED, (keys[pygame.K_DOWN] - keys[pygame.K_UP]) * CAMERA_SPEED)
+
+		# run as many simulation steps as it takes to catch up with the time
+		# that has passed
+		game_accumulator += frame_time
+		while (game_accumulator >= TICK_TIME):
+			game_accumulator -= TICK_TIME
+			if (current_screen == SCREEN_GAME):
+				tick_game()
+
+		# draw the game and do the shops
+		draw_game(game_accumulator / TICK_TIME)
+		do_shop()
+		play_game_sounds()
+	profiler.lap('screen')
+
+	# play the sounds of the frame
+	sound_dispatcher.flush()
+	profiler.lap('sound')
+
+	# draw the profiler
+	if (show_profiler):
+		draw_profiler()
+		profiler.lap('profiler')
 
 	# do screenshake
 	SHAKE_DISSIPATE = 0.5
-	game_screenshake_x = -game_screenshake_x * SHAKE_DISSIPATE
-	game_screenshake_y = -game_screenshake_y * SHAKE_DISSIPATE
+	game.screenshake_x = -game.screenshake_x * SHAKE_DISSIPATE
+	game.screenshake_y = -game.screenshake_y * SHAKE_DISSIPATE
 
-	# copy the surface to the screen
-	scaled_surface = pygame.transform.scale(surface, (window_w * gfx_scale, window_h * gfx_scale))
-	screen.fill((0, 0, 0), (0, 0, window_w * gfx_scale, window_h * gfx_scale))
-	screen.blit(scaled_surface, (int(game_screenshake_x), int(game_screenshake_y)))
+	# copy the surface to the screen. the screenshake is measured in pixels
+	# of a screen that is (gfx_scale) times bigger than the game
+	present(int(game.screenshake_x * screen_scale / gfx_scale), int(game.screenshake_y * screen_scale / gfx_scale))
+	profiler.lap('present')
 
 	# update the display
 	pygame.display.update()
+	profiler.lap('flip')
+
+	# the time spent waiting for the next frame isn't part of the frame
+	profiler.end_frame()
+
+	# fit the particles to the budget of the screen and to how long the frame
+	# took
+	game.particles.budget = PARTICLE_BUDGETS[current_screen]
+	game.particles.update_lod(profiler.latest())
 	clock.tick(60)
 	iteration += 1
 
-	# do timing
-	elapsed = ms() - ms0
-	if (iteration % 60 == 0):
-		print('frame', iteration + 1, 'took', elapsed, 'ms')
+# save the replay of the game that the player left, if any
+if (current_screen == SCREEN_GAME):
+	save_replay()
 
 # clean up
 pygame.quit()
@@ -0,0 +1,135 @@
+# Bank Heist by Adam Sidat
+#
+# a frame profiler. every frame is split into named phases, and the time that
+# each phase takes is kept for the last few hundred frames, so that it's easy
+# to see which part of the game is blowing the frame budget
+
+import csv
+import json
+import time
+import tracemalloc
+import numpy as np
+
+# the time budget of one frame at 60 frames per second, in milliseconds
+FRAME_BUDGET = 1000.0 / 60.0
+
+# the percentiles that are reported
+PROFILER_PERCENTILES = (50, 95, 99)
+
+# a frame profiler. a frame is started with begin_frame(), then lap(name) is
+# called at the end of every phase to charge the time since the last lap to
+# that phase, and the frame is finished with end_frame(). a phase can be
+# lapped more than once per frame (the game can step a few times per frame),
+# in which case the times are added up.
+#
+# if (track_memory) is True, the profiler also measures how much memory each
+# phase allocates, using tracemalloc (which has to be started by whoever
+# wants this, since it slows everything down). this is the most memory that
+# was in use during the phase, above what was in use when it started, so
+# short-lived numpy arrays and lists are counted too
+class Profiler:
+	# create a profiler that remembers the last (window) frames
+	def __init__(self, window=300, enabled=True, track_memory=False):
+		self.window = window
+		self.enabled = enabled
+		self.track_memory = track_memory
+		self.frames = 0
+		# the times of each phase in nanoseconds and the memory allocated by
+		# each phase in bytes, in ring buffers of (window) frames
+		self.history = {}
+		self.memory_history = {}
+		# the times and memory of each phase in the current frame
+		self.current = {}
+		self.memory = {}
+		self.frame_start = time.perf_counter_ns()
+		self.last = self.frame_start
+		self.last_memory = 0
+
+	# start a frame
+	def begin_frame(self):
+		if (not self.enabled):
+			return
+		self.current = {}
+		self.memory = {}
+		if (self.track_memory):
+			tracemalloc.reset_peak()
+			self.last_memory = tracemalloc.get_traced_memory()[0]
+		self.frame_start = time.perf_counter_ns()
+		self.last = self.frame_start
+
+	# charge the time since the last lap (or the start of the frame) to the
+	# phase (name)
+	def lap(self, name):
+		if (not self.enabled):
+			return
+		now = time.perf_counter_ns()
+		self.current[name] = self.current.get(name, 0) + now - self.last
+		if (self.track_memory):
+			memory, peak = tracemalloc.get_traced_memory()
+			self.memory[name] = self.memory.get(name, 0) + peak - self.last_memory
+			tracemalloc.reset_peak()
+			self.last_memory = memory
+			# don't count the time spent asking tracemalloc
+			now = time.perf_counter_ns()
+		self.last = now
+
+	# finish a frame. the whole frame is kept as the phase 'frame'
+	def end_frame(self):
+		if (not self.enabled):
+			return
+		self.current['frame'] = time.perf_counter_ns() - self.frame_start
+		self.memory['frame'] = sum(self.memory.values())
+		i = self.frames % self.window
+		for name in self.current:
+			if (name not in self.history):
+				# a new phase took no time in the frames before it showed up
+				self.history[name] = np.zeros(self.window, dtype=np.int64)
+				self.memory_history[name] = np.zeros(self.window, dtype=np.int64)
+		for name, times in self.history.items():
+			times[i] = self.current.get(name, 0)
+			self.memory_history[name][i] = self.memory.get(name, 0)
+		self.frames += 1
+
+	# get how long the phase (name) took in the last finished frame, in
+	# milliseconds
+	def latest(self, name='frame'):
+		if (self.frames == 0 or name not in self.history):
+			return 0.0
+		return float(self.history[name][(self.frames - 1) % self.window] / 1000000.0)
+
+	# get the statistics of every phase over the remembered frames, in
+	# milliseconds. returns a dictionary of dictionaries with the mean, the
+	# maximum and the percentiles (as 'p50', 'p95' and so on) of each phase.
+	# if memory is being tracked, the mean kilobytes allocated per frame are
+	# there too, as 'alloc_kb'
+	def stats(self):
+		n = min(self.frames, self.window)
+		out = {}
+		if (n == 0):
+			return out
+		for name, times in self.history.items():
+			t = times[:n] / 1000000.0
+			p = np.percentile(t, PROFILER_PERCENTILES)
+			out[name] = {'mean': float(t.mean()), 'max': float(t.max())}
+			for j in range(0, len(PROFILER_PERCENTILES)):
+				out[name]['p' + str(PROFILER_PERCENTILES[j])] = float(p[j])
+			if (self.track_memory):
+				out[name]['alloc_kb'] = float(self.memory_history[name][:n].mean() / 1024.0)
+		return out
+
+	# save the statistics to a file. the file is JSON if (path) ends in
+	# '.json', and CSV otherwise
+	def dump(self, path):
+		stats = self.stats()
+		columns = ['mean', 'max'] + ['p' + str(p) for p in PROFILER_PERCENTILES]
+		if (self.track_memory):
+			columns.append('alloc_kb')
+		if (path.endswith('.json')):
+			with open(path, 'w') as f:
+				json.dump({'frames': min(self.frames, self.window), 'budget': FRAME_BUDGET, 'phases': stats}, f, indent=4)
+		else:
+			with open(path, 'w', newline='') as f:
+				writer = csv.writer(f)
+				writer.writerow(['phase'] + columns)
+				for name in sorted(stats):
+					writer.writerow([name] + [stats[name][c] for c in columns])